@@ -2,95 +2,728 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import os
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-import logging
-from logging import Formatter, FileHandler
-from flask_wtf import Form
+import base64
+from flask import Flask, Blueprint, current_app, render_template, request, Response, flash, redirect, url_for, abort, session, jsonify, make_response, stream_with_context, has_request_context, g, before_render_template, template_rendered
 from forms import *
-from datetime import datetime
-
-# imported flask-migrate, datetime
+import config
+from datetime import datetime, timedelta, timezone
+import hashlib
+import time
+from itertools import islice
+from collections import namedtuple
+from functools import wraps, lru_cache
+import click
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, object_session
+from flask.logging import default_handler
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.local import LocalProxy
+from search import NgramIndex
+from cache import LRUCache, PageCache, make_page_cache
+from pool_stats import PoolStats, engine_pool_stats, timed_pool_class
+from sql_stats import QueryBudgetExceeded, QueryLog, SqlStats
+from log_queue import BackgroundQueueHandler, log_handler
+from metrics import MetricsStore, RequestMetrics
+from profiler import SamplingProfiler, profile_token, valid_profile_token, write_profile
+from replicas import ReplicaSet
+from template_cache import FragmentCacheExtension
+from catalog_io import FORMATS, Checkpoint, batched, export_chunks, read_rows
+from models import db, Genre, venue_genres, artist_genres, Venue, Artist, Show
+from werkzeug.datastructures import MultiDict
+
+# babel, dateutil and flask_migrate are imported where they are used, so
+# importing the app (every worker boot and CLI command) stays cheap
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+# views, filters and commands register on the blueprint; create_app() builds
+# an app around it (`flask --app app` finds the factory on its own)
+bp = Blueprint('fyyur', __name__, cli_group=None)
+
+# the current app's page cache, read replicas, per-route SQL totals,
+# Prometheus metrics and profiler
+page_cache = LocalProxy(lambda: current_app.extensions['page_cache'])
+replica_set = LocalProxy(lambda: current_app.extensions['replica_set'])
+sql_stats = LocalProxy(lambda: current_app.extensions['sql_stats'])
+request_metrics = LocalProxy(lambda: current_app.extensions['metrics'])
+profiler = LocalProxy(lambda: current_app.extensions['profiler'])
+
+
+def create_app(environment=None):
+    from flask_moment import Moment
+
+    app = Flask(__name__)
+    app.config.from_object('config')
+    app.config.from_object(config.environments[environment or os.environ.get('FYYUR_ENV', 'development')])
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError('Set SECRET_KEY in the environment to run in production.')
+    # time checkouts on the primary's pool for /metrics/pool (in-memory SQLite
+    # keeps its single-connection pool)
+    if ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI'] and app.config['SQLALCHEMY_DATABASE_URI'] != 'sqlite://':
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'],
+                                                       poolclass=timed_pool_class(PoolStats()))
+    Moment(app)
+    db.init_app(app)
+    # TODO: connect to a local postgresql database - COMPLETED, added migrate
+    # migrations are only needed by `flask db`; alembic is slow to import
+    if os.environ.get('FLASK_RUN_FROM_CLI'):
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    # read replicas, each on the same engine options with its own timed pool
+    app.extensions['replica_set'] = ReplicaSet({
+        'replica_{}'.format(number): create_engine(replica_uri, **dict(
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'], poolclass=timed_pool_class(PoolStats())))
+        for number, replica_uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS'])
+    }, app.config['REPLICA_HEALTH_CHECK_INTERVAL'])
+    app.extensions['page_cache'] = make_page_cache(app.config)
+    app.extensions['sql_stats'] = SqlStats()
+    # with several workers, /metrics adds up the totals they save to METRICS_DIR
+    app.extensions['metrics'] = RequestMetrics(MetricsStore(
+        app.config['METRICS_DIR'], app.config['METRICS_SAVE_SECONDS']) if app.config['METRICS_DIR'] else None,
+        lambda: process_stats(app))
+    app.extensions['profiler'] = SamplingProfiler(
+        app.config['PROFILE_INTERVAL_MS'] / 1000, app.config['PROFILE_MAX_PER_MINUTE'])
+    # templates compiled once to bytecode on disk, and the store behind the
+    # {% cache %} fragments of the list pages
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if app.config['TEMPLATE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+    if app.config['FRAGMENT_CACHE_ENABLED']:
+        app.jinja_env.fragment_cache = PageCache(LRUCache(max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES']))
+    before_render_template.connect(start_render_timer, app)
+    template_rendered.connect(record_render_time, app)
+    app.register_blueprint(bp)
+    configure_logging(app)
+    return app
 
-# TODO: connect to a local postgresql database - COMPLETED, added migrate
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+
+def count_new_show(show, now=None):
+    # bump the counters of the show's venue and artist in the same transaction
+    # as the insert; the caller commits.
+    now = now or datetime.now()
+    counter = 'upcoming_shows_count' if show.start_time > now else 'past_shows_count'
+    for model, entity_id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+        model.query.filter(model.id == entity_id).update(
+            {counter: getattr(model, counter) + 1}, synchronize_session=False)
+
+
+def refresh_show_counts(venue_ids=None, artist_ids=None, now=None):
+    # recount upcoming/past shows straight from the Show table. None means
+    # every row; an empty collection means none. The caller commits.
+    now = now or datetime.now()
+    for model, fk, ids in ((Venue, Show.venue_id, venue_ids), (Artist, Show.artist_id, artist_ids)):
+        if ids is not None and not ids:
+            continue
+        shows = db.session.query(db.func.count(Show.id)).filter(fk == model.id)
+        values = {
+            'upcoming_shows_count': shows.filter(Show.start_time > now).scalar_subquery(),
+            'past_shows_count': shows.filter(Show.start_time <= now).scalar_subquery()
+        }
+        query = model.query
+        if ids is not None:
+            query = query.filter(model.id.in_(ids))
+        query.update(values, synchronize_session=False)
+    # bulk updates skip the ORM hooks; the counters show on the venue and
+    # artist pages, which depend on 'artists' and 'venues' respectively
+    if venue_ids is None or artist_ids is None:
+        queue_cache_invalidation(db.session, ['venues', 'artists'])
+    else:
+        queue_cache_invalidation(db.session, ['venues'] + ['venue:{}'.format(venue_id) for venue_id in venue_ids] +
+                                 ['artist:{}'.format(artist_id) for artist_id in artist_ids])
+
+
+def roll_show_counts(since, now=None):
+    # shows that started in (since, now] have moved from upcoming to past;
+    # only their venues and artists need recounting.
+    now = now or datetime.now()
+    moved = db.session.query(Show.venue_id, Show.artist_id).filter(
+        Show.start_time > since, Show.start_time <= now).distinct().all()
+    refresh_show_counts(venue_ids={row.venue_id for row in moved},
+                        artist_ids={row.artist_id for row in moved},
+                        now=now)
+    return len(moved)
 
 #----------------------------------------------------------------------------#
-# Models.
+# Search.
 #----------------------------------------------------------------------------#
 
+SearchResult = namedtuple('SearchResult', ['id', 'name'])
+
+# in-process name indexes used when the database has no pg_trgm, by model:
+# (version, built at, index). A commit that touches the model bumps its
+# namespace in the page cache, which every worker sharing the cache sees;
+# SEARCH_INDEX_TTL covers writers that do not share it.
+name_indexes = {}
+NAME_NAMESPACES = {Venue: 'venue-names', Artist: 'artist-names'}
+
+
+def note_name_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        queue_cache_invalidation(session, [NAME_NAMESPACES[type(target)]])
+
+
+for searchable in (Venue, Artist):
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(searchable, event_name, note_name_change)
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_by_name(model, search_term):
+    # case-insensitive partial match on name, best matches first and capped
+    # at SEARCH_RESULT_LIMIT.
+    limit = current_app.config['SEARCH_RESULT_LIMIT']
+    if db.engine.dialect.name == 'postgresql':
+        # ILIKE is served by the gin_trgm_ops index, similarity() ranks the hits
+        return db.session.query(model.id, model.name).filter(
+            model.name.ilike('%{}%'.format(escape_like(search_term)), escape='\\')
+        ).order_by(
+            db.func.similarity(model.name, search_term).desc(), model.name
+        ).limit(limit).all()
+
+    # the version is read before the rows, so a commit landing mid-build
+    # leaves the index already outdated rather than stale for good
+    version = page_cache.version(NAME_NAMESPACES[model])
+    entry = name_indexes.get(model)
+    if entry is None or entry[0] != version or time.time() - entry[1] > current_app.config['SEARCH_INDEX_TTL']:
+        index = NgramIndex()
+        # built from the primary: an index built from a lagging replica would
+        # be kept until the next change
+        primary = db.session.info.get('primary') or db.engine
+        rows = db.session.execute(db.select(model.id, model.name), bind_arguments={'bind': primary})
+        for entity_id, name in rows:
+            index.add(entity_id, name)
+        entry = name_indexes[model] = (version, time.time(), index)
+    index = entry[2]
+    return [SearchResult(*match) for match in index.search(search_term, limit)]
+
+
+def search_document(entity):
+    if isinstance(entity, Venue):
+        fields = [entity.name, entity.city, entity.state, entity.address,
+                  entity.seeking_talent_description]
+    else:
+        fields = [entity.name, entity.city, entity.state, entity.seeking_description]
+    fields.extend(genre.name for genre in entity.genres)
+    return ' '.join(field for field in fields if field)
+
 
-class Venue(db.Model):
-    __tablename__ = 'Venue'
+def update_search_vector(mapper, connection, target):
+    document = search_document(target)
+    if connection.dialect.name == 'postgresql':
+        target.search_vector = db.func.to_tsvector('english', document)
+    else:
+        target.search_vector = document.lower()
 
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    address = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
-    genres = db.Column(db.String)
-    website = db.Column(db.String(500))
-    facebook_link = db.Column(db.String(500))
-    seeking_talent = db.Column(db.String)
-    seeking_talent_description = db.Column(db.String())
-    venue_shows = db.relationship('Show', backref='Venues', lazy=True)
 
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate
-    # COMPLETED
+for searchable in (Venue, Artist):
+    for event_name in ('before_insert', 'before_update'):
+        event.listen(searchable, event_name, update_search_vector)
 
 
-class Artist(db.Model):
-    __tablename__ = 'Artist'
+def search_catalog(search_term):
+    # venues and artists matching every word of the term across name, genres,
+    # city and description, ranked together in one UNION ALL query.
+    limit = current_app.config['SEARCH_RESULT_LIMIT']
+    postgres = db.engine.dialect.name == 'postgresql'
+    if postgres:
+        tsquery = db.func.plainto_tsquery('english', search_term)
+    words = search_term.lower().split()
 
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    website = db.Column(db.String(500))
-    image_link = db.Column(db.String(500))
-    genres = db.Column(db.String)
-    facebook_link = db.Column(db.String(120))
-    seeking_venue = db.Column(db.String())
-    seeking_description = db.Column(db.String(1000))
-    artist_shows = db.relationship('Show', backref='Artist', lazy=True)
+    def matching(model, kind):
+        if postgres:
+            rank = db.func.ts_rank(model.search_vector, tsquery)
+            match = model.search_vector.op('@@')(tsquery)
+        else:
+            rank = db.literal(0.0)
+            match = db.and_(*[model.search_vector.contains(word, autoescape=True) for word in words])
+        return db.session.query(
+            db.literal(kind).label('kind'),
+            model.id.label('id'),
+            model.name.label('name'),
+            model.city.label('city'),
+            model.state.label('state'),
+            rank.label('rank')
+        ).filter(match).statement
+
+    if not words:
+        return []
+    query = db.union_all(matching(Venue, 'venue'), matching(Artist, 'artist')).order_by(
+        db.desc('rank'), 'name').limit(limit)
+    return db.session.execute(query).all()
 
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate - COMPLETED
+#----------------------------------------------------------------------------#
+# Genres.
+#----------------------------------------------------------------------------#
 
-# TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration. - COMPLETED
 
+def lookup_genres(names):
+    # Genre rows for the submitted names, creating the ones not seen before
+    names = sorted(set(names))
+    if not names:
+        return []
+    genres = Genre.query.filter(Genre.name.in_(names)).all()
+    known = {genre.name for genre in genres}
+    genres.extend(Genre(name=name) for name in names if name not in known)
+    return genres
 
-class Show(db.Model):
-    __tablename__ = 'Show'
 
-    id = db.Column(db.Integer, primary_key=True)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
-    start_time = db.Column(db.DateTime, nullable=True)
+def filter_by_genre(query, model, genre):
+    # restrict a Venue/Artist query to one genre through the association index
+    if not genre:
+        return query
+    links = venue_genres if model is Venue else artist_genres
+    link_id = links.c.venue_id if model is Venue else links.c.artist_id
+    return query.join(links, link_id == model.id).join(
+        Genre, Genre.id == links.c.genre_id).filter(Genre.name == genre)
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+
+def cached_page(*namespaces):
+    # cache the rendered page per URL until one of its namespaces is
+    # invalidated or CACHE_DEFAULT_TTL runs out. Namespaces may use the view
+    # arguments, e.g. 'venue:{venue_id}'.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # pages carrying a flash message are one-offs
+            if not current_app.config['CACHE_ENABLED'] or '_flashes' in session:
+                return view(**kwargs)
+            # read-your-writes: a client that just wrote reads from the
+            # primary, past a cached copy that may predate its change
+            sticky_seconds = current_app.config['REPLICA_STICKY_SECONDS']
+            if time.time() - session.get('wrote_at', 0) < sticky_seconds:
+                return view(**kwargs)
+            page_namespaces = [namespace.format(**kwargs) for namespace in namespaces]
+            key = page_cache.key(request.full_path, page_namespaces)
+            page = page_cache.get(key)
+            if page is None:
+                page = view(**kwargs)
+                # a replica may not have caught up with a recent write yet;
+                # caching its render would hand the old data to the writer
+                # once it leaves the primary
+                lagging = (db.session.info.get('replica') is not None and
+                           page_cache.invalidated_within(page_namespaces, sticky_seconds))
+                if isinstance(page, str) and not lagging:
+                    page_cache.set(key, page)
+            return page
+        return wrapper
+    return decorator
+
+
+def note_cache_invalidation(mapper, connection, target):
+    # remember what a flush touched; the namespaces are only invalidated once
+    # the transaction commits
+    session = object_session(target)
+    if session is None:
+        return
+    if isinstance(target, Venue):
+        namespaces = ['venues', 'venue:{}'.format(target.id)]
+    elif isinstance(target, Artist):
+        namespaces = ['artists', 'artist:{}'.format(target.id)]
+    else:
+        # a show changes the venue counters on /venues as well
+        namespaces = ['shows', 'venues', 'venue:{}'.format(target.venue_id),
+                      'artist:{}'.format(target.artist_id)]
+    queue_cache_invalidation(session, namespaces)
+
+
+def queue_cache_invalidation(session, namespaces):
+    # invalidated when the session commits, dropped if it rolls back
+    session.info.setdefault('cache_invalidations', set()).update(namespaces)
+
+
+def invalidate_page_cache(session):
+    page_cache.invalidate(*session.info.pop('cache_invalidations', ()))
+
+
+def discard_cache_invalidations(session):
+    session.info.pop('cache_invalidations', None)
+
+
+for cached_model in (Venue, Artist, Show):
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(cached_model, event_name, note_cache_invalidation)
+event.listen(Session, 'after_commit', invalidate_page_cache)
+event.listen(Session, 'after_rollback', discard_cache_invalidations)
+
+#----------------------------------------------------------------------------#
+# Request log and SQL instrumentation.
+#----------------------------------------------------------------------------#
+
+
+def query_budget(endpoint):
+    return current_app.config['SQL_QUERY_BUDGETS'].get(endpoint, current_app.config['SQL_QUERY_BUDGET'])
+
+
+@bp.before_app_request
+def start_request_log():
+    g.request_started = time.perf_counter()
+    g.query_log = QueryLog()
+    if not profiler.enabled:
+        return
+    # PROFILE_ENABLED samples every request and keeps the slow ones; a signed
+    # header profiles one request and always keeps it
+    token = request.headers.get(current_app.config['PROFILE_HEADER'])
+    forced = bool(token) and valid_profile_token(current_app.config['SECRET_KEY'], request.path, token)
+    if forced or current_app.config['PROFILE_ENABLED']:
+        g.profile = profiler.start(forced)
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    # every engine (primary, replicas, the async engines' sync side) reports
+    # here; statements outside a request (CLI commands) are not logged
+    if context is None or not has_request_context():
+        return
+    log = g.get('query_log')
+    if log is None:
+        return
+    log.record(statement, time.perf_counter() - context.query_started)
+    budget = query_budget(request.endpoint)
+    if current_app.config['SQL_QUERY_BUDGET_STRICT'] and budget is not None and log.count > budget:
+        raise QueryBudgetExceeded('{} ran {} statements, over its budget of {}: {}'.format(
+            request.endpoint, log.count, budget, dict(log.fingerprints.most_common(3))))
+
+
+event.listen(Engine, 'before_cursor_execute', start_query_timer)
+event.listen(Engine, 'after_cursor_execute', record_query)
+
+
+@bp.after_app_request
+def add_query_headers(response):
+    g.response_status = response.status_code
+    log = g.get('query_log')
+    if log is None:
+        return response
+    if response.is_streamed:
+        # a streamed export queries as it is sent, after the headers; its
+        # stream_with_context tears the request down a second time at the end
+        g.query_log_streaming = True
+    elif current_app.config['SQL_QUERY_HEADERS']:
+        response.headers['X-Query-Count'] = str(log.count)
+        response.headers['X-Query-Time-Ms'] = '{:.2f}'.format(log.seconds * 1000)
+    return response
+
+
+@bp.teardown_app_request
+def log_request(error=None):
+    # once the response is sent: add the request to the route totals and
+    # metrics and log it, as a warning when it went over its SQL budget or
+    # repeated a statement
+    if g.pop('query_log_streaming', False):
+        return
+    log = g.pop('query_log', None)
+    if log is None:
+        return
+    route = request.endpoint or 'unmatched'
+    budget = query_budget(request.endpoint)
+    over_budget = budget is not None and log.count > budget
+    repeated = log.repeated(current_app.config['SQL_REPEAT_THRESHOLD'])
+    sql_stats.record(route, log, repeated, over_budget)
+
+    status = g.pop('response_status', 500)
+    duration = time.perf_counter() - g.pop('request_started')
+    request_metrics.observe_request(route, request.method, status, duration, log.count, log.seconds)
+    request_metrics.keep_saving()
+
+    fields = {
+        'route': route,
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'status': status,
+        'duration_ms': round(duration * 1000, 3),
+        'queries': log.count,
+        'db_ms': round(log.seconds * 1000, 3)
+    }
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.stop(profile)
+        path = save_profile(profile, fields)
+        if path:
+            fields['profile'] = path
+    message = '%s %s %s in %.1f ms, %d queries'
+    args = (fields['method'], fields['path'], fields['status'], fields['duration_ms'], fields['queries'])
+    if over_budget or repeated:
+        fields['budget'] = budget
+        fields['repeated'] = [{'statement': sql, 'count': count} for sql, count in repeated]
+        current_app.logger.warning(message + ' (budget %s, repeated statements: %d)',
+                                   *args, budget, len(repeated), extra=fields)
+    else:
+        current_app.logger.info(message, *args, extra=fields)
+
+
+def save_profile(profile, fields):
+    # write a finished profile if the request was slow (or asked for one) and
+    # the rate limit allows; returns its path
+    config = current_app.config
+    if not profile.forced and fields['duration_ms'] < config['PROFILE_THRESHOLD_MS']:
+        return None
+    if not profiler.limit.allow():
+        return None
+    summary = dict(fields, started=profile.started, render_ms=round(g.get('render_seconds', 0) * 1000, 3),
+                   interval_ms=config['PROFILE_INTERVAL_MS'], samples=profile.samples, parts=dict(profile.parts))
+    try:
+        return write_profile(config['PROFILE_DIR'], profile, summary, config['PROFILE_KEEP'])
+    except OSError:
+        current_app.logger.exception('Profile of %s could not be written', fields['path'])
+        return None
+
+
+def start_render_timer(sender, template, context, **extra):
+    g.setdefault('render_started', []).append(time.perf_counter())
+
+
+def record_render_time(sender, template, context, **extra):
+    started = g.get('render_started')
+    if started:
+        elapsed = time.perf_counter() - started.pop()
+        g.render_seconds = g.get('render_seconds', 0) + elapsed
+        request_metrics.observe_render(template.name or 'string', elapsed)
+
+#----------------------------------------------------------------------------#
+# Read routing.
+#----------------------------------------------------------------------------#
+
+
+def read_only(view):
+    # lets a POST view that never writes (the search forms) read from a replica
+    view.read_only = True
+    return view
+
+
+@bp.before_app_request
+def route_reads_to_replica():
+    if not replica_set:
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    if request.method not in ('GET', 'HEAD') and not getattr(view, 'read_only', False):
+        return
+    # read-your-writes: a client that just wrote stays on the primary until
+    # the replicas have caught up
+    if time.time() - session.get('wrote_at', 0) < current_app.config['REPLICA_STICKY_SECONDS']:
+        return
+    db.session.info['replica'] = replica_set.choose()
+
+
+def note_flush_write(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+def note_statement_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+def stick_to_primary(db_session):
+    if db_session.info.pop('wrote', False) and has_request_context():
+        session['wrote_at'] = time.time()
+
+
+def discard_write_note(db_session):
+    db_session.info.pop('wrote', None)
+
+
+event.listen(Session, 'after_flush', note_flush_write)
+event.listen(Session, 'do_orm_execute', note_statement_write)
+event.listen(Session, 'after_commit', stick_to_primary)
+event.listen(Session, 'after_rollback', discard_write_note)
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#----------------------------------------------------------------------------#
+
+
+def version_query(model, entity_id, now):
+    # everything a venue/artist page depends on, from one aggregate over its
+    # shows: its own row, its shows, the venues/artists they link to, and
+    # how many shows are still upcoming (the page changes as shows start)
+    if model is Venue:
+        fk, other, other_fk = Show.venue_id, Artist, Show.artist_id
+    else:
+        fk, other, other_fk = Show.artist_id, Venue, Show.venue_id
+    return db.session.query(
+        model.updated_at.label('updated_at'),
+        db.func.count(Show.id).label('num_shows'),
+        db.func.count(Show.id).filter(Show.start_time > now).label('num_upcoming'),
+        db.func.max(Show.updated_at).label('shows_updated'),
+        db.func.max(other.updated_at).label('others_updated'),
+        db.func.max(Show.start_time).filter(Show.start_time <= now).label('last_started')
+    ).outerjoin(Show, fk == model.id).outerjoin(other, other.id == other_fk).filter(
+        model.id == entity_id).group_by(model.id)
+
+
+def entity_version(model, entity_id, row=None):
+    # the page's ETag and Last-Modified; `row` is the version_query() row
+    # when the caller already fetched it
+    if row is None:
+        row = version_query(model, entity_id, datetime.now()).first()
+        if row is None:
+            abort(404)
+
+    etag = hashlib.sha1('{}:{}:{!r}'.format(model.__tablename__, entity_id, tuple(row)).encode('utf-8')).hexdigest()
+    updated_at, num_shows, num_upcoming, shows_updated, others_updated, last_started = row
+    # Last-Modified from the same inputs as the ETag: the updated_at columns
+    # (UTC) cover edits and new shows, and the start of the latest show that
+    # has begun (local time) covers a show moving from upcoming to past.
+    # Shows are never deleted, so the counts change through nothing else.
+    changes = [value.replace(tzinfo=timezone.utc) for value in (updated_at, shows_updated, others_updated) if value]
+    if last_started is not None:
+        changes.append(last_started.astimezone(timezone.utc))
+    return etag, max(changes).replace(microsecond=0)
+
+
+def not_modified(etag, last_modified):
+    # If-None-Match uses the weak comparison (RFC 9110 13.1.2)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    if since is None:
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified <= since
+
+
+def conditional_page(model, id_arg):
+    # answer If-None-Match/If-Modified-Since with a 304 before touching the
+    # rest of the view; only the version query runs. Without either header,
+    # the view runs first and entity_with_shows() hands back the version it
+    # fetched along with the page, so a full render is one round trip.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if '_flashes' in session:
+                return view(**kwargs)
+            if request.if_none_match or request.if_modified_since:
+                etag, last_modified = entity_version(model, kwargs[id_arg])
+                if not_modified(etag, last_modified):
+                    response = Response(status=304)
+                else:
+                    response = make_response(view(**kwargs))
+            else:
+                response = make_response(view(**kwargs))
+                # a page from the page cache ran no query yet
+                etag, last_modified = g.pop('entity_version', None) or entity_version(model, kwargs[id_arg])
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+#----------------------------------------------------------------------------#
+# Show listings.
+#----------------------------------------------------------------------------#
+
+
+def entity_with_shows(model, entity_id):
+    # a venue/artist together with its genre names and a projection of its
+    # shows (the other side's id, name and image plus start_time), split into
+    # upcoming and past in one pass over a single query. Window functions cap
+    # the lists at the soonest UPCOMING_SHOWS_LIMIT and the most recent
+    # PAST_SHOWS_LIMIT, so entities with long histories never load them in
+    # full. The same query fetches the page's version for conditional_page()
+    # (in g.entity_version).
+    if model is Venue:
+        fk, other, other_fk, prefix = Show.venue_id, Artist, Show.artist_id, 'artist'
+    else:
+        fk, other, other_fk, prefix = Show.artist_id, Venue, Show.venue_id, 'venue'
+    now = datetime.now()
+    upcoming = Show.start_time > now
+    upcoming_limit = current_app.config['UPCOMING_SHOWS_LIMIT']
+    past_limit = current_app.config['PAST_SHOWS_LIMIT']
+
+    shows = db.session.query(
+        Show.id,
+        Show.start_time,
+        other.id.label('other_id'),
+        other.name.label('other_name'),
+        other.image_link.label('other_image_link'),
+        db.func.row_number().over(
+            partition_by=upcoming, order_by=Show.start_time
+        ).label('soonness'),
+        db.func.row_number().over(
+            partition_by=upcoming, order_by=Show.start_time.desc()
+        ).label('recency')
+    ).join(other, other.id == other_fk).filter(
+        fk == entity_id, Show.start_time.isnot(None)
+    ).subquery()
+
+    shown_upcoming = shows.c.start_time > now
+    if upcoming_limit is not None:
+        shown_upcoming = db.and_(shown_upcoming, shows.c.soonness <= upcoming_limit)
+    shown_past = shows.c.start_time <= now
+    if past_limit is not None:
+        shown_past = db.and_(shown_past, shows.c.recency <= past_limit)
+    shown = db.or_(shown_upcoming, shown_past)
+    version = version_query(model, entity_id, now).subquery()
+    # genres come aggregated into one column rather than from the selectin
+    # load of the relationship
+    rows = db.session.query(
+        model, genre_list(model), *version.c,
+        shows.c.id, shows.c.other_id, shows.c.other_name, shows.c.other_image_link, shows.c.start_time
+    ).select_from(model).join(version, db.true()).outerjoin(shows, shown).filter(
+        model.id == entity_id
+    ).options(db.lazyload(model.genres)).order_by(shows.c.start_time, shows.c.id).all()
+    if not rows:
+        abort(404)
+
+    entity, genre_names, *version_row = rows[0][:2 + len(version.c)]
+    g.entity_version = entity_version(model, entity_id, tuple(version_row))
+    genres = sorted(genre_names.split(';')) if genre_names else []
+    upcoming_shows = []
+    past_shows = []
+    for entity, genre_names, *version_row, show_id, other_id, other_name, other_image_link, start_time in rows:
+        if start_time is None:
+            continue
+        show = {
+            prefix + '_id': other_id,
+            prefix + '_name': other_name,
+            prefix + '_image_link': other_image_link,
+            'start_time': start_time.strftime("%m/%d/%Y, %H:%M")
+        }
+        if start_time > now:
+            upcoming_shows.append(show)
+        else:
+            past_shows.append(show)
+    # most recent past show first
+    past_shows.reverse()
+    return entity, genres, upcoming_shows, past_shows
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
 
+def parse_datetime(value):
+    import dateutil.parser
+    return dateutil.parser.parse(value)
+
+
 def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
+    import babel.dates
+    date = parse_datetime(value)
     if format == 'full':
         format = "EEEE MMMM, d, y 'at' h:mma"
     elif format == 'medium':
@@ -98,14 +731,14 @@ def format_datetime(value, format='medium'):
     return babel.dates.format_datetime(date, format)
 
 
-app.jinja_env.filters['datetime'] = format_datetime
+bp.add_app_template_filter(format_datetime, 'datetime')
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('pages/home.html')
 
@@ -113,49 +746,68 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues', methods=['GET'])
+@bp.route('/venues', methods=['GET'])
+@cached_page('venues')
 def venues():
-    # TODO: replace with real venues data.
-    #       num_shows should be aggregated based on number of upcoming shows per venue.
-    data = []
-    locations = set()
-    areas = Venue.query.all()
-    for area in areas:
-        locations.add((area.city, area.state))
-    for location in locations:
-        data.append({
-            "city": location[0],
-            "state": location[1],
-            "venues": []
+    # num_upcoming_shows comes from the venue's counter column, so the page
+    # costs a single query no matter how many venues or shows there are.
+    # ?genre=Jazz narrows the list to one genre.
+    genre = request.args.get('genre')
+    return render_template('pages/venues.html', areas=venue_areas(genre))
+
+
+def venue_areas(genre=None):
+    # one query: every venue with its upcoming show count, ordered so that
+    # venues of the same city/state arrive next to each other.
+    query = db.session.query(
+        Venue.id,
+        Venue.name,
+        Venue.city,
+        Venue.state,
+        Venue.upcoming_shows_count.label('num_upcoming_shows'),
+        Venue.updated_at
+    )
+    rows = filter_by_genre(query, Venue, genre).order_by(Venue.state, Venue.city, Venue.name).all()
+
+    # bucket venues by (city, state) with a dict instead of scanning every area per venue
+    areas = {}
+    for row in rows:
+        area = areas.get((row.city, row.state))
+        if area is None:
+            area = areas[(row.city, row.state)] = {
+                "city": row.city,
+                "state": row.state,
+                "venues": []
+            }
+        area['venues'].append({
+            "id": row.id,
+            "name": row.name,
+            "num_upcoming_shows": row.num_upcoming_shows,
+            "updated_at": row.updated_at
         })
+    return list(areas.values())
 
-    for area in areas:
-        num_upcoming_shows = 0
-
-        shows = Show.query.filter_by(venue_id=area.id).all()
-        now = datetime.now()
-        for show in shows:
-            if show.start_time > now:
-                num_upcoming_shows += 1
 
-        for location in data:
-            if area.state == location['state'] and area.city == location['city']:
-                location['venues'].append({
-                    "id": area.id,
-                    "name": area.name,
-                    "num_upcoming_shows": num_upcoming_shows
-                })
-
-    return render_template('pages/venues.html', areas=data)
+@bp.route('/search', methods=['GET'])
+def search():
+    # mixed venue/artist results from the full-text index: /search?search_term=jazz austin
+    search_term = request.args.get('search_term', '')
+    results = search_catalog(search_term)
+    response = {
+        "count": len(results),
+        "data": results
+    }
+    return render_template('pages/search.html', results=response, search_term=search_term)
 
 
-@app.route('/venues/search', methods=['POST'])
+@bp.route('/venues/search', methods=['POST'])
+@read_only
 def search_venues():
     # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
     # seach for Hop should return "The Musical Hop".
     # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
     search_term = request.form.get('search_term', '')
-    venues = Venue.query.filter(Venue.name.ilike('%{}%'.format(search_term))).all()
+    venues = search_by_name(Venue, search_term)
     response = {
         "count": len(venues),
         "data": venues
@@ -163,43 +815,45 @@ def search_venues():
     return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
-@app.route('/venues/<int:venue_id>', methods=['GET'])
+@bp.route('/venues/<int:venue_id>', methods=['GET'])
+@conditional_page(Venue, 'venue_id')
+@cached_page('venue:{venue_id}', 'artists')
 def show_venue(venue_id):
-    # shows the venue page with the given venue_id
-    # TODO: replace with real venue data from the venues table, using venue_id
-    venue = Venue.query.get(venue_id)
-    genres = venue.genres.split(",")
+    # the venue, its genres and a projection of its shows come back from one
+    # query
+    venue, genres, upcoming_shows, past_shows = entity_with_shows(Venue, venue_id)
 
     data = {
         'id': venue.id,
         'name': venue.name,
         'address': venue.address,
-        'genres': [item.replace('{', '').replace('}', '') for item in genres],
+        'genres': genres,
         'city': venue.city,
         'state': venue.state,
         'phone': venue.phone,
         'website': venue.website,
         'facebook_link': venue.facebook_link,
         'seeking_talent': venue.seeking_talent,
+        'seeking_talent_description': venue.seeking_talent_description,
         'image_link': venue.image_link,
+        'upcoming_shows': upcoming_shows,
+        'upcoming_shows_count': venue.upcoming_shows_count,
+        'past_shows': past_shows,
+        'past_shows_count': venue.past_shows_count,
     }
-    past_shows = db.session.query(Show.artist_id, Show.start_time).filter(
-        Show.venue_id == venue.id, Show.start_time < datetime.now()).all()
-    upcoming_shows = db.session.query(Venue).join(
-        Show, Show.venue_id == venue.id).filter(Show.start_time > datetime.utcnow())
     return render_template('pages/show_venue.html', venue=data)
 
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@bp.route('/venues/create', methods=['GET'])
 def create_venue_form():
     form = VenueForm()
     return render_template('forms/new_venue.html', form=form)
 
 
-@app.route('/venues/create', methods=['POST'])
+@bp.route('/venues/create', methods=['POST'])
 def create_venue_submission():
     # TODO: insert form data as a new Venue record in the db, instead
     if request.method == 'POST':
@@ -210,7 +864,7 @@ def create_venue_submission():
         address = request.form['address']
         phone = request.form['phone']
         image_link = request.form['image_link']
-        genres = request.form.getlist('genres')
+        genres = lookup_genres(request.form.getlist('genres'))
         facebook_link = request.form['facebook_link']
         if 'seeking_talent' not in request.form:
             seeking_talent = False
@@ -229,7 +883,6 @@ def create_venue_submission():
                       seeking_talent=seeking_talent,
                       seeking_talent_description=seeking_talent_description)
         try:
-            print(venue)
             db.session.add(venue)
             db.session.commit()
             # on successful db insert, flash success
@@ -239,14 +892,14 @@ def create_venue_submission():
             error = True
             # on unsuccessful db insert, flash an error instead.
             flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
-            print(sys.exe_info())
+            current_app.logger.exception('Venue %s could not be listed', request.form['name'])
         finally:
             db.session.close()
 
         return render_template('pages/home.html')
 
 
-@app.route('/venues/<int:venue_id>', methods=['POST'])
+@bp.route('/venues/<int:venue_id>', methods=['POST'])
 def delete_venue(venue_id):
     # TODO: Complete this endpoint for taking a venue_id, and using
     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
@@ -270,24 +923,25 @@ def delete_venue(venue_id):
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@bp.route('/artists')
+@cached_page('artists')
 def artists():
-    # TODO: replace with real data returned from querying the database
-    data = []
-    artists = Artist.query.all()
-    for artist in artists:
-        data.append(artist)
+    # ?genre=Jazz narrows the list to one genre
+    genre = request.args.get('genre')
+    query = db.session.query(Artist.id, Artist.name, Artist.updated_at)
+    data = filter_by_genre(query, Artist, genre).order_by(Artist.name).all()
 
     return render_template('pages/artists.html', artists=data)
 
 
-@app.route('/artists/search', methods=['POST'])
+@bp.route('/artists/search', methods=['POST'])
+@read_only
 def search_artists():
     # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
     # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
     # search for "band" should return "The Wild Sax Band".
     search_term = request.form.get('search_term', '')
-    artists = Artist.query.filter(Artist.name.ilike('%{}%'.format(search_term))).all()
+    artists = search_by_name(Artist, search_term)
     response = {
         "count": len(artists),
         "data": artists
@@ -295,39 +949,18 @@ def search_artists():
     return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 
-@app.route('/artists/<int:artist_id>')
+@bp.route('/artists/<int:artist_id>')
+@conditional_page(Artist, 'artist_id')
+@cached_page('artist:{artist_id}', 'venues')
 def show_artist(artist_id):
-    # shows the venue page with the given venue_id
-    # TODO: replace with real venue data from the venues table, using venue_id
-    artist = Artist.query.get(artist_id)
-    genres = artist.genres.split(',')
-    now = datetime.utcnow()
-    #shows = Show.query.fliter_by(artist_id=artist_id).all()
-    find_upcoming_shows = db.session.query(Show).join(Venue).filter(Show.artist_id == artist_id, Show.start_time > now).all()
-    find_past_shows = db.session.query(Show).join(Venue).filter(Show.artist_id == artist_id, Show.start_time < now).all()
-    upcoming_shows = []
-    past_shows = []
-
-    for show in find_upcoming_shows:
-        upcoming_shows.append([{
-            'venue_id': show.id,
-            'venue_name': show.name,
-            'image_link': show.image_link,
-            'start_time': show.start_time.strftime("%m/%d/%Y, %H:%M")
-        }])
-
-    for show in find_past_shows:
-        past_shows.append([{
-            'venue_id': show.id,
-            'venue_name': artist.name,
-            'image_link': artist.image_link,
-            'start_time': show.start_time.strftime("%m/%d/%Y, %H:%M")
-        }])
+    # the artist, its genres and a projection of its shows come back from one
+    # query
+    artist, genres, upcoming_shows, past_shows = entity_with_shows(Artist, artist_id)
 
     data = {
         'id': artist.id,
         'name': artist.name,
-        'genres': [item.replace('{', '').replace('}', '') for item in genres],
+        'genres': genres,
         'city': artist.city,
         'state': artist.state,
         'phone': artist.phone,
@@ -337,30 +970,25 @@ def show_artist(artist_id):
         'seeking_description': artist.seeking_description,
         'image_link': artist.image_link,
         'upcoming_shows': upcoming_shows,
-        'upcoming_shows_count': len(upcoming_shows),
-        'past_shows_count': len(past_shows),
+        'upcoming_shows_count': artist.upcoming_shows_count,
+        'past_shows_count': artist.past_shows_count,
         'past_shows': past_shows
     }
 
-    #artist.upcoming_shows_count = db.session.query(Show.venue_id, Show.start_time).filter(Show.artist_id == artist.id, Show.start_time >= datetime.now()).count()
-    #artist.upcoming_shows = db.session.query(Show.venue_id, Show.start_time).filter(Show.artist_id == artist.id, Show.start_time >= datetime.now()).all()
-    #artist.past_shows_count = db.session.query(Show.venue_id, Show.start_time).filter(Show.artist_id == artist.id, Show.start_time < datetime.now()).count()
-    #artist.past_shows = db.session.query(Show.venue_id, Show.start_time).filter(Show.artist_id == artist.id, Show.start_time < datetime.now()).all()
-
     return render_template('pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@bp.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
     artist = Artist.query.get(artist_id)
     form = ArtistForm(obj=artist)
-    print(form.name.data)
+    form.genres.data = [genre.name for genre in artist.genres]
     # TODO: populate form with fields from artist with ID <artist_id>
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@bp.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
     # TODO: take values from the form submitted, and update existing
     # artist record with ID <artist_id> using the new attributes
@@ -369,9 +997,8 @@ def edit_artist_submission(artist_id):
         form = request.form.to_dict(True)
         try:
             artist = Artist.query.get(artist_id)
-            artist.genres = []
             artist.name = form['name']
-            artist.genres = request.form.getlist('genres')
+            artist.genres = lookup_genres(request.form.getlist('genres'))
             artist.city = form['city']
             artist.state = form['state']
             artist.phone = form['phone']
@@ -385,22 +1012,22 @@ def edit_artist_submission(artist_id):
             # on unsuccessful db insert, flash an error instead.
             flash('An error occurred. Artist ' +
                   request.form['name'] + ' could not be updated.')
-            print(sys.exe_info())
+            current_app.logger.exception('Artist %s could not be updated', artist_id)
         finally:
             db.session.close()
-    return redirect(url_for('show_artist', artist_id=artist_id))
+    return redirect(url_for('.show_artist', artist_id=artist_id))
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@bp.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
     venue = Venue.query.get(venue_id)
     form = VenueForm(obj=venue)
-    print(form.name.data)
+    form.genres.data = [genre.name for genre in venue.genres]
     # TODO: populate form with values from venue with ID <venue_id>
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@bp.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
     # TODO: take values from the form submitted, and update existing
     # venue record with ID <venue_id> using the new attributes
@@ -409,9 +1036,8 @@ def edit_venue_submission(venue_id):
         form = request.form.to_dict(True)
         try:
             venue = Venue.query.get(venue_id)
-            venue.genres = []
             venue.name = form['name']
-            venue.genres = request.form.getlist('genres')
+            venue.genres = lookup_genres(request.form.getlist('genres'))
             venue.city = form['city']
             venue.state = form['state']
             venue.phone = form['phone']
@@ -423,23 +1049,23 @@ def edit_venue_submission(venue_id):
             error = True
             # on unsuccessful db insert, flash an error instead.
             flash('An error occurred. Venue ' + request.form['name'] + ' could not be updated.')
-            print(sys.exe_info())
+            current_app.logger.exception('Venue %s could not be updated', venue_id)
         finally:
             db.session.close()
 
-        return redirect(url_for('show_venue', venue_id=venue_id))
+        return redirect(url_for('.show_venue', venue_id=venue_id))
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
 
-@app.route('/artists/create', methods=['GET'])
+@bp.route('/artists/create', methods=['GET'])
 def create_artist_form():
     form = ArtistForm()
     return render_template('forms/new_artist.html', form=form)
 
 
-@app.route('/artists/create', methods=['POST'])
+@bp.route('/artists/create', methods=['POST'])
 def create_artist_submission():
     # called upon submitting the new artist listing form
     # TODO: insert form data as a new Venue record in the db, instead
@@ -451,7 +1077,7 @@ def create_artist_submission():
         phone = request.form['phone']
         website = request.form['website']
         image_link = request.form['image_link']
-        genres = request.form.getlist('genres')
+        genres = lookup_genres(request.form.getlist('genres'))
         facebook_link = request.form['facebook_link']
         if 'seeking_venue' not in request.form:
             seeking_venue = False
@@ -470,7 +1096,6 @@ def create_artist_submission():
                         seeking_venue=seeking_venue,
                         seeking_description=seeking_description)
         try:
-            print(artist)
             db.session.add(artist)
             db.session.commit()
             # on successful db insert, flash success
@@ -482,7 +1107,7 @@ def create_artist_submission():
             # on unsuccessful db insert, flash an error instead.
             flash('An error occurred. Artist ' +
                   request.form['name'] + ' could not be listed.')
-            print(sys.exe_info())
+            current_app.logger.exception('Artist %s could not be listed', request.form['name'])
         finally:
             db.session.close()
 
@@ -492,50 +1117,82 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@bp.route('/shows')
+@cached_page('shows', 'venues', 'artists')
 def shows():
-    # displays list of shows at /shows
-    # TODO: replace with real venues data.
-    #       num_shows should be aggregated based on number of upcoming shows per venue.
+    # displays list of shows at /shows, newest first, one page at a time.
+    # Pages are keyed on (start_time, id) so each page is a bounded index scan
+    # instead of loading the whole table: ?before=<start_time>&before_id=<id>&limit=<n>
+    limit = request.args.get('limit', current_app.config['SHOWS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['SHOWS_PAGE_SIZE_MAX']))
+
+    query = db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        # versions of what a show's tile displays, for its fragment cache key
+        Show.updated_at,
+        Venue.updated_at.label('venue_updated_at'),
+        Artist.updated_at.label('artist_updated_at')
+    ).join(Venue, Venue.id == Show.venue_id).join(
+        Artist, Artist.id == Show.artist_id
+    ).filter(Show.start_time.isnot(None))
+
+    before = request.args.get('before')
+    if before:
+        try:
+            before = parse_datetime(before)
+        except (ValueError, OverflowError):
+            abort(400)
+        before_id = request.args.get('before_id', type=int)
+        if before_id is None:
+            query = query.filter(Show.start_time < before)
+        else:
+            query = query.filter(db.or_(
+                Show.start_time < before,
+                db.and_(Show.start_time == before, Show.id < before_id)
+            ))
+
+    # fetch one extra row to know whether there is an older page
+    rows = query.order_by(Show.start_time.desc(), Show.id.desc()).limit(limit + 1).all()
+    older = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        older = {
+            "before": rows[-1].start_time.isoformat(),
+            "before_id": rows[-1].id,
+            "limit": limit
+        }
+
     data = []
-    shows = Show.query.order_by(Show.start_time.desc()).all()
-    for show in shows:
-        venue = Venue.query.filter_by(id=show.venue_id).first_or_404()
-        artist = Artist.query.filter_by(id=show.artist_id).first_or_404()
-        data.extend([{
-            "venue_id": venue.id,
-            "venue_name": venue.name,
-            "artist_id": artist.id,
-            "artist_name": artist.name,
-            "artist_image_link": artist.image_link,
-            "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-        }])
-    return render_template('pages/shows.html', shows=data)
-
-    #data = []
-    # order_by(Show.start_time.desc)
-    #shows = Show.query.order_by(Show.start_time.desc()).all()
-    # for show in shows:
-    #venue = Venue.query.filter_by(id=shows.venue_id).all()
-    #artist = Artist.query.filter_by(id=shows.artist_id).all()
-    # data = ([{
-    # "venue_id": venue.id,
-    # "venue_name": venue.name,
-    # "artist_id": artist.id,
-    # "artist_name": artist.name,
-    # "artist_image_link": artist.image_link,
-    # "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-    # }])
-
-
-@app.route('/shows/create')
+    for show in rows:
+        data.append({
+            "id": show.id,
+            "venue_id": show.venue_id,
+            "venue_name": show.venue_name,
+            "artist_id": show.artist_id,
+            "artist_name": show.artist_name,
+            "artist_image_link": show.artist_image_link,
+            "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M"),
+            "updated_at": show.updated_at,
+            "venue_updated_at": show.venue_updated_at,
+            "artist_updated_at": show.artist_updated_at
+        })
+    return render_template('pages/shows.html', shows=data, older=older)
+
+
+@bp.route('/shows/create')
 def create_shows():
     # renders form. do not touch.
     form = ShowForm()
     return render_template('forms/new_show.html', form=form)
 
 
-@app.route('/shows/create', methods=['POST'])
+@bp.route('/shows/create', methods=['POST'])
 def create_show_submission():
     # called to create new shows in the db, upon submitting new show listing form
     # TODO: insert form data as a new Show record in the db, instead
@@ -543,48 +1200,592 @@ def create_show_submission():
         error = False
         artist_id = request.form['artist_id']
         venue_id = request.form['venue_id']
-        start_time = request.form['start_time']
-        # TODO: modify data to be the data object returned from db insertion
-        show = Show(artist_id=artist_id,
-                    venue_id=venue_id,
-                    start_time=start_time)
         try:
-            print(show)
+            start_time = parse_datetime(request.form['start_time'])
+            if start_time.tzinfo is not None:
+                # shows are stored and compared in naive local time
+                start_time = start_time.astimezone().replace(tzinfo=None)
+            # TODO: modify data to be the data object returned from db insertion
+            show = Show(artist_id=artist_id,
+                        venue_id=venue_id,
+                        start_time=start_time)
             db.session.add(show)
+            count_new_show(show)
             db.session.commit()
             # on successful db insert, flash success
             flash('Show was successfully listed!')
+        except (ValueError, OverflowError):
+            # an unreadable start time
+            error = True
+            flash('An error occurred. The show could not be listed.')
         except:
             db.session.rollback()
             error = True
             # on unsuccessful db insert, flash an error instead.
             flash('An error occurred. The show could not be listed.')
-            print(sys.exe_info())
+            current_app.logger.exception('Show of artist %s at venue %s could not be listed', artist_id, venue_id)
         finally:
             db.session.close()
 
         return render_template('pages/home.html')
 
 
-@app.errorhandler(404)
+#  JSON API
+#  ----------------------------------------------------------------
+
+# fields each resource can return (?fields=a,b), the ones returned by
+# default, extra filters, and the keyset order used for cursor pagination
+API_RESOURCES = {
+    'venues': {
+        'model': Venue,
+        'fields': lambda: {
+            'id': Venue.id, 'name': Venue.name, 'city': Venue.city, 'state': Venue.state,
+            'address': Venue.address, 'phone': Venue.phone, 'website': Venue.website,
+            'image_link': Venue.image_link, 'facebook_link': Venue.facebook_link,
+            'genres': genre_list(Venue), 'seeking_talent': Venue.seeking_talent,
+            'seeking_talent_description': Venue.seeking_talent_description,
+            'upcoming_shows_count': Venue.upcoming_shows_count,
+            'past_shows_count': Venue.past_shows_count, 'updated_at': Venue.updated_at,
+        },
+        'default_fields': ('id', 'name', 'city', 'state'),
+        'order': ((Venue.id, False),),
+    },
+    'artists': {
+        'model': Artist,
+        'fields': lambda: {
+            'id': Artist.id, 'name': Artist.name, 'city': Artist.city, 'state': Artist.state,
+            'phone': Artist.phone, 'website': Artist.website, 'image_link': Artist.image_link,
+            'facebook_link': Artist.facebook_link, 'genres': genre_list(Artist),
+            'seeking_venue': Artist.seeking_venue, 'seeking_description': Artist.seeking_description,
+            'upcoming_shows_count': Artist.upcoming_shows_count,
+            'past_shows_count': Artist.past_shows_count, 'updated_at': Artist.updated_at,
+        },
+        'default_fields': ('id', 'name', 'city', 'state'),
+        'order': ((Artist.id, False),),
+    },
+    'shows': {
+        'model': Show,
+        'fields': lambda: {
+            'id': Show.id, 'start_time': Show.start_time,
+            'venue_id': Show.venue_id, 'venue_name': Venue.name, 'venue_image_link': Venue.image_link,
+            'artist_id': Show.artist_id, 'artist_name': Artist.name, 'artist_image_link': Artist.image_link,
+            'updated_at': Show.updated_at,
+        },
+        'default_fields': ('id', 'start_time', 'venue_id', 'venue_name', 'artist_id', 'artist_name'),
+        # newest first, like /shows
+        'order': ((Show.start_time, True), (Show.id, True)),
+    },
+}
+
+
+def api_error(status, message):
+    return jsonify({'error': message}), status
+
+
+def iso_datetime(value):
+    return value.isoformat()
+
+
+def genre_names_list(value):
+    return value.split(';') if value else []
+
+
+API_CONVERTERS = {
+    'start_time': iso_datetime,
+    'updated_at': iso_datetime,
+    'genres': genre_names_list,
+}
+
+
+@lru_cache(maxsize=256)
+def api_serializer(fields):
+    # build the row -> dict function once per field set instead of per row
+    converters = tuple((index, API_CONVERTERS[field]) for index, field in enumerate(fields)
+                       if field in API_CONVERTERS)
+    count = len(fields)
+
+    if not converters:
+        def serialize(row):
+            return dict(zip(fields, row[:count]))
+    else:
+        def serialize(row):
+            values = list(row[:count])
+            for index, convert in converters:
+                if values[index] is not None:
+                    values[index] = convert(values[index])
+            return dict(zip(fields, values))
+    return serialize
+
+
+def api_fields(resource):
+    requested = request.args.get('fields')
+    if not requested:
+        return resource['default_fields']
+    fields = tuple(dict.fromkeys(field.strip() for field in requested.split(',') if field.strip()))
+    available = resource['fields']()
+    unknown = [field for field in fields if field not in available]
+    if unknown or not fields:
+        return None
+    return fields
+
+
+def api_query(resource, fields):
+    # select only the requested columns (plus the keyset columns at the end)
+    # and join venue/artist only when one of their fields was asked for
+    columns = resource['fields']()
+    selected = [columns[field].label(field) for field in fields]
+    selected.extend(column.label('_order_{}'.format(index))
+                    for index, (column, descending) in enumerate(resource['order']))
+    query = db.session.query(*selected).select_from(resource['model'])
+    if resource['model'] is Show:
+        if any(field.startswith('venue_') and field != 'venue_id' for field in fields):
+            query = query.join(Venue, Venue.id == Show.venue_id)
+        if any(field.startswith('artist_') and field != 'artist_id' for field in fields):
+            query = query.join(Artist, Artist.id == Show.artist_id)
+    return query
+
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, order):
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    if not isinstance(values, list) or len(values) != len(order):
+        raise ValueError('cursor does not match this resource')
+    decoded = []
+    for (column, descending), value in zip(order, values):
+        # only a scalar of the sort column's type may reach the query
+        if isinstance(column.type, db.DateTime) and isinstance(value, str):
+            decoded.append(datetime.fromisoformat(value))
+        elif isinstance(column.type, db.Integer) and isinstance(value, int) and not isinstance(value, bool):
+            decoded.append(value)
+        elif isinstance(column.type, db.String) and isinstance(value, str):
+            decoded.append(value)
+        else:
+            raise ValueError('cursor does not match this resource')
+    return decoded
+
+
+def keyset_filter(order, values):
+    # rows strictly after the cursor in (col1, col2, ...) order:
+    # col1 > v1 OR (col1 = v1 AND col2 > v2) ...
+    clauses = []
+    for index, (column, descending) in enumerate(order):
+        equal = [order[earlier][0] == values[earlier] for earlier in range(index)]
+        after = column < values[index] if descending else column > values[index]
+        clauses.append(db.and_(*equal, after))
+    return db.or_(*clauses)
+
+
+@bp.route('/api/v1/<resource_name>')
+def api_list(resource_name):
+    # /api/v1/venues?fields=id,name,genres&limit=50&cursor=...
+    resource = API_RESOURCES.get(resource_name)
+    if resource is None:
+        return api_error(404, 'Unknown resource.')
+    fields = api_fields(resource)
+    if fields is None:
+        return api_error(400, 'Unknown or empty fields; choose from: {}.'.format(
+            ', '.join(resource['fields']())))
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['API_PAGE_SIZE_MAX']))
+    order = resource['order']
+
+    query = api_query(resource, fields)
+    model = resource['model']
+    if model is Show:
+        for filter_name in ('venue_id', 'artist_id'):
+            value = request.args.get(filter_name, type=int)
+            if value is not None:
+                query = query.filter(getattr(Show, filter_name) == value)
+        query = query.filter(Show.start_time.isnot(None))
+    else:
+        query = filter_by_genre(query, model, request.args.get('genre'))
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            query = query.filter(keyset_filter(order, decode_cursor(cursor, order)))
+        except (ValueError, TypeError):
+            return api_error(400, 'Invalid cursor.')
+    query = query.order_by(*[column.desc() if descending else column for column, descending in order])
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][len(fields):])
+    serialize = api_serializer(fields)
+    return jsonify({'data': [serialize(row) for row in rows], 'next_cursor': next_cursor})
+
+
+@bp.route('/api/v1/<resource_name>/<int:entity_id>')
+def api_detail(resource_name, entity_id):
+    resource = API_RESOURCES.get(resource_name)
+    if resource is None:
+        return api_error(404, 'Unknown resource.')
+    fields = api_fields(resource)
+    if fields is None:
+        return api_error(400, 'Unknown or empty fields; choose from: {}.'.format(
+            ', '.join(resource['fields']())))
+    model = resource['model']
+    row = api_query(resource, fields).filter(model.id == entity_id).first()
+    if row is None:
+        return api_error(404, '{} {} not found.'.format(resource_name[:-1].capitalize(), entity_id))
+    return jsonify({'data': api_serializer(fields)(row)})
+
+
+#  Export
+#  ----------------------------------------------------------------
+
+@bp.route('/export/<kind>')
+def export(kind):
+    # /export/shows?format=jsonl streams the whole table as a chunked response
+    file_format = request.args.get('format', 'csv')
+    if kind not in EXPORT_KINDS or file_format not in FORMATS:
+        abort(404)
+    response = Response(stream_with_context(export_rows(kind, file_format)),
+                        mimetype=EXPORT_MIMETYPES[file_format])
+    response.headers['Content-Disposition'] = 'attachment; filename={}.{}'.format(kind, file_format)
+    return response
+
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+def process_stats(app):
+    # the pools and caches of this process as of now, for /metrics; also
+    # called by the thread that saves the metrics, outside any request
+    with app.app_context():
+        engines = {'primary': db.session.info.get('primary') or db.engine}
+        if replica_set:
+            engines.update(replica_set.engines)
+        caches = {'page': page_cache.stats()}
+        if app.jinja_env.fragment_cache is not None:
+            caches['fragment'] = app.jinja_env.fragment_cache.stats()
+        return {'pools': {name: engine_pool_stats(engine) for name, engine in engines.items()}, 'caches': caches}
+
+
+@bp.route('/metrics')
+def metrics():
+    # Prometheus text format: per-route requests, latency and SQL use,
+    # template render times, the pools and the caches, added up over the
+    # worker processes when METRICS_DIR is set
+    return Response('\n'.join(request_metrics.exposition()) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/metrics/cache')
+def cache_metrics():
+    stats = page_cache.stats()
+    if current_app.jinja_env.fragment_cache is not None:
+        stats['fragments'] = current_app.jinja_env.fragment_cache.stats()
+    return jsonify(stats)
+
+
+@bp.route('/metrics/sql')
+def sql_metrics():
+    return jsonify(sql_stats.snapshot())
+
+
+@bp.route('/metrics/pool')
+def pool_metrics():
+    stats = engine_pool_stats(db.session.info.get('primary') or db.engine)
+    if replica_set:
+        healthy = replica_set.stats()
+        stats['replicas'] = {
+            name: dict(engine_pool_stats(engine), healthy=healthy[name])
+            for name, engine in replica_set.engines.items()
+        }
+    return jsonify(stats)
+
+
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+def configure_logging(app):
+    if app.debug:
+        return
+    # requests only queue their records; a background thread writes them to
+    # LOG_FILE as JSON lines. The logger is shared by every app in the
+    # process, so a new app replaces the previous pipeline.
+    for handler in [handler for handler in app.logger.handlers if isinstance(handler, BackgroundQueueHandler)]:
+        app.logger.removeHandler(handler)
+        handler.close()
+    # Flask's own handler would write every record to stderr, synchronously
+    app.logger.removeHandler(default_handler)
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+    app.logger.addHandler(log_handler(app.config))
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#----------------------------------------------------------------------------#
+
+IMPORT_KINDS = {
+    'venues': (Venue, VenueForm),
+    'artists': (Artist, ArtistForm),
+    'shows': (Show, ShowForm),
+}
+
+
+def import_form_data(row):
+    # turn a CSV/JSON Lines record into form data. CSV cells list several
+    # genres separated by ';', JSON Lines records use a list.
+    data = MultiDict()
+    for key, value in row.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = 'y' if value else ''
+        if key == 'genres' and isinstance(value, str):
+            value = [genre.strip() for genre in value.split(';') if genre.strip()]
+        if isinstance(value, list):
+            for item in value:
+                data.add(key, str(item))
+        elif value != '':
+            data.add(key, str(value))
+    return data
+
+
+def validate_import_rows(kind, rows, first_line):
+    # run every row through the same form the create views use
+    model, form_class = IMPORT_KINDS[kind]
+    records = []
+    rejected = []
+    for line, row in enumerate(rows, start=first_line):
+        form = form_class(formdata=import_form_data(row), meta={'csrf': False})
+        if form.validate():
+            records.append((line, form.data))
+        else:
+            rejected.append((line, form.errors))
+    return records, rejected
+
+
+def insert_shows(records):
+    # executemany straight into Show, skipping rows whose venue or artist does
+    # not exist, then recount the touched venues and artists
+    venue_ids = {data['venue_id'] for line, data in records}
+    artist_ids = {data['artist_id'] for line, data in records}
+    known_venues = {row.id for row in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids))}
+    known_artists = {row.id for row in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids))}
+    rows = []
+    rejected = []
+    for line, data in records:
+        if data['venue_id'] not in known_venues or data['artist_id'] not in known_artists:
+            rejected.append((line, {'venue_id/artist_id': ['Unknown venue or artist.']}))
+            continue
+        rows.append({
+            'venue_id': data['venue_id'],
+            'artist_id': data['artist_id'],
+            'start_time': data['start_time']
+        })
+    if rows:
+        db.session.execute(Show.__table__.insert(), rows)
+        touched_venues = {row['venue_id'] for row in rows}
+        touched_artists = {row['artist_id'] for row in rows}
+        # Core inserts skip the ORM hooks; the recount queues the venue and
+        # artist pages for invalidation on commit
+        refresh_show_counts(venue_ids=touched_venues, artist_ids=touched_artists)
+        queue_cache_invalidation(db.session, ['shows'])
+    return len(rows), rejected
+
+
+def insert_entities(model, records):
+    # venues/artists go through the ORM so the search vector hooks run; the
+    # flush still sends the batch as multi-row INSERTs
+    names = {name for line, data in records for name in data['genres']}
+    genres = {genre.name: genre for genre in lookup_genres(names)}
+    for line, data in records:
+        fields = dict(data)
+        fields['genres'] = [genres[name] for name in data['genres']]
+        db.session.add(model(**fields))
+    return len(records), []
+
+#----------------------------------------------------------------------------#
+# Export.
+#----------------------------------------------------------------------------#
+
+EXPORT_KINDS = ('venues', 'artists', 'shows')
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def genre_list(model):
+    # the entity's genre names as one ';'-separated string, aggregated by a
+    # correlated subquery so exported rows need no per-row lookups
+    links = venue_genres if model is Venue else artist_genres
+    link_id = links.c.venue_id if model is Venue else links.c.artist_id
+    if db.engine.dialect.name == 'postgresql':
+        names = db.func.string_agg(Genre.name, db.literal_column("';'"))
+    else:
+        names = db.func.group_concat(Genre.name, ';')
+    return db.session.query(names).select_from(links).join(
+        Genre, Genre.id == links.c.genre_id).filter(link_id == model.id).scalar_subquery()
+
+
+def export_query(kind):
+    # column-projected query for the catalog export, using the field names
+    # `flask import` expects
+    if kind == 'shows':
+        query = db.session.query(
+            Show.id,
+            Show.start_time,
+            Show.venue_id,
+            Venue.name.label('venue_name'),
+            Show.artist_id,
+            Artist.name.label('artist_name')
+        ).join(Venue, Venue.id == Show.venue_id).join(
+            Artist, Artist.id == Show.artist_id
+        ).order_by(Show.id)
+    elif kind == 'venues':
+        query = db.session.query(
+            Venue.id, Venue.name, Venue.city, Venue.state, Venue.address, Venue.phone,
+            Venue.website, Venue.image_link, Venue.facebook_link,
+            genre_list(Venue).label('genres'),
+            Venue.seeking_talent, Venue.seeking_talent_description
+        ).order_by(Venue.id)
+    else:
+        query = db.session.query(
+            Artist.id, Artist.name, Artist.city, Artist.state, Artist.phone,
+            Artist.website, Artist.image_link, Artist.facebook_link,
+            genre_list(Artist).label('genres'),
+            Artist.seeking_venue, Artist.seeking_description
+        ).order_by(Artist.id)
+    return query
+
+
+def export_rows(kind, format):
+    # stream the table through a server-side cursor, EXPORT_BATCH_SIZE rows
+    # at a time, so memory stays flat whatever the table size. A generator, so
+    # the query only opens its session once the response streams, inside the
+    # context that closes it afterwards.
+    query = export_query(kind)
+    columns = [column['name'] for column in query.column_descriptions]
+    rows = query.yield_per(current_app.config['EXPORT_BATCH_SIZE'])
+    yield from export_chunks(columns, rows, format, chunk_rows=current_app.config['EXPORT_BATCH_SIZE'])
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+
+@bp.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(FORMATS),
+              help='File format; guessed from the extension by default.')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Rows validated and committed per transaction.')
+@click.option('--checkpoint', 'checkpoint_path',
+              help='Progress file used to resume an interrupted import (default: PATH.checkpoint).')
+def import_command(kind, path, file_format, batch_size, checkpoint_path):
+    # stream a CSV / JSON Lines file of venues, artists or shows into the
+    # database, one transaction per batch
+    model = IMPORT_KINDS[kind][0]
+    checkpoint = Checkpoint(checkpoint_path or path + '.checkpoint')
+    done = checkpoint.load()
+    if done:
+        click.echo('Resuming after row {}.'.format(done))
+    imported = rejected = 0
+    started = time.perf_counter()
+
+    for batch in batched(islice(read_rows(path, file_format), done, None), batch_size):
+        records, invalid = validate_import_rows(kind, batch, done + 1)
+        try:
+            if kind == 'shows':
+                count, missing = insert_shows(records)
+            else:
+                count, missing = insert_entities(model, records)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            click.echo('Batch starting at row {} failed; rerun to resume from there.'.format(done + 1), err=True)
+            raise
+        for line, errors in sorted(invalid + missing):
+            click.echo('Row {} rejected: {}'.format(line, errors), err=True)
+        imported += count
+        rejected += len(invalid) + len(missing)
+        done += len(batch)
+        checkpoint.save(done)
+        click.echo('{} rows read, {} imported, {} rejected'.format(done, imported, rejected))
+
+    checkpoint.clear()
+    elapsed = time.perf_counter() - started
+    click.echo('Imported {} {} ({} rejected) in {:.1f}s: {:.0f} rows/s'.format(
+        imported, kind, rejected, elapsed, (imported + rejected) / elapsed if elapsed else 0))
+
+
+@bp.cli.command('roll-show-counts')
+@click.option('--minutes', default=0, type=int,
+              help='Only recount venues/artists with shows that started in the last N minutes '
+                   '(run on a schedule at least that often). 0 recounts everything.')
+def roll_show_counts_command(minutes):
+    # periodic job keeping upcoming_shows_count/past_shows_count in step with the clock
+    now = datetime.now()
+    if minutes:
+        moved = roll_show_counts(now - timedelta(minutes=minutes), now=now)
+        click.echo('Rolled over counters for {} venue/artist pairs.'.format(moved))
+    else:
+        refresh_show_counts(now=now)
+        click.echo('Recounted shows for all venues and artists.')
+    db.session.commit()
+
+
+@bp.cli.command('check-query-plans')
+def check_query_plans_command():
+    # EXPLAIN the hot Show queries against the current (seeded) database and
+    # fail if any of them scans the Show table instead of using an index
+    now = datetime.now()
+    queries = {
+        'venue shows': db.session.query(Show.id, Show.start_time).filter(
+            Show.venue_id == 1, Show.start_time > now).order_by(Show.start_time),
+        'artist shows': db.session.query(Show.id, Show.start_time).filter(
+            Show.artist_id == 1, Show.start_time > now).order_by(Show.start_time),
+        'shows listing': db.session.query(Show.id, Show.start_time).filter(
+            Show.start_time < now).order_by(Show.start_time.desc()).limit(current_app.config['SHOWS_PAGE_SIZE'])
+    }
+    postgres = db.engine.dialect.name == 'postgresql'
+    failed = False
+    for name, query in queries.items():
+        sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        if postgres:
+            plan = '\n'.join(row[0] for row in db.session.execute(db.text('EXPLAIN ' + sql)))
+            uses_index = 'Seq Scan on "Show"' not in plan
+        else:
+            plan = '\n'.join(row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql)))
+            uses_index = 'USING' in plan and 'INDEX' in plan
+        failed = failed or not uses_index
+        click.echo('{}: {}\n{}\n'.format(name, 'index' if uses_index else 'SEQUENTIAL SCAN', plan))
+    if failed:
+        raise SystemExit(1)
+
+
+@bp.cli.command('profile-token')
+@click.argument('path')
+@click.option('--minutes', default=10, show_default=True, help='How long the token stays valid.')
+def profile_token_command(path, minutes):
+    # header value that makes the app profile PATH, e.g.
+    # curl -H "X-Fyyur-Profile: $(flask profile-token /artists/1)" ...
+    if not os.environ.get('SECRET_KEY'):
+        click.echo('SECRET_KEY is not set: the server will not accept this token.', err=True)
+    click.echo(profile_token(current_app.config['SECRET_KEY'], path, time.time() + minutes * 60))
+
+
+@bp.cli.command('export')
+@click.argument('kind', type=click.Choice(EXPORT_KINDS))
+@click.option('--format', 'file_format', type=click.Choice(FORMATS), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-',
+              help='File to write (default: stdout).')
+def export_command(kind, file_format, output):
+    # dump venues, artists or shows as CSV / JSON Lines, streaming
+    for chunk in export_rows(kind, file_format):
+        output.write(chunk)
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -592,11 +1793,11 @@ if not app.debug:
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
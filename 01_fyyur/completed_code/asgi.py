@@ -0,0 +1,154 @@
+#----------------------------------------------------------------------------#
+# Async serving.
+#
+# ASGI entry point: `uvicorn asgi:application`. Every request runs the regular
+# Flask app inside a greenlet (SQLAlchemy's asyncio bridge) over engines with
+# an asyncio driver, asyncpg on PostgreSQL and aiosqlite on SQLite. While one
+# request waits on the database the event loop serves the others, so a single
+# worker keeps many requests in flight. Views, templates, caches and replica
+# routing are the same as under WSGI.
+#----------------------------------------------------------------------------#
+
+import contextvars
+import os
+import sys
+from io import BytesIO
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import await_only, greenlet_spawn
+
+from app import create_app
+from models import db
+from pool_stats import PoolStats, timed_pool_class
+
+app = create_app(os.environ.get('FYYUR_ENV', 'production'))
+# every request runs on the event loop's thread, so the sampling profiler
+# could not tell their stacks apart
+app.extensions['profiler'].enabled = False
+if app.config['PROFILE_ENABLED']:
+    app.logger.warning('PROFILE_ENABLED is ignored under asgi.py; profile under wsgi.py instead.')
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite'
+}
+
+
+def async_url(uri):
+    scheme, rest = uri.split('://', 1)
+    return '{}://{}'.format(ASYNC_DRIVERS.get(scheme.split('+')[0], scheme), rest)
+
+
+def async_engine(uri):
+    options = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    options.pop('poolclass', None)
+    options.pop('connect_args', None)
+    if ':memory:' not in uri and uri != 'sqlite://':
+        options['poolclass'] = timed_pool_class(PoolStats(), base=AsyncAdaptedQueuePool)
+    if app.config['DB_STATEMENT_TIMEOUT_MS'] and uri.startswith('postgresql'):
+        # asyncpg takes server settings rather than libpq options
+        options['connect_args'] = {
+            'server_settings': {'statement_timeout': str(app.config['DB_STATEMENT_TIMEOUT_MS'])}
+        }
+    return create_async_engine(async_url(uri), **options)
+
+
+# the views keep using db.session; its sessions bind to the sync facades of
+# the async engines, which only work inside greenlet_spawn
+primary_engine = async_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+replica_engines = {
+    'replica_{}'.format(number): async_engine(replica_uri)
+    for number, replica_uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS'])
+}
+db.session.session_factory.configure(info={'primary': primary_engine.sync_engine})
+app.extensions['replica_set'].use({name: engine.sync_engine for name, engine in replica_engines.items()})
+
+
+def wsgi_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def run_wsgi(environ, send):
+    # runs in the request's greenlet: blocking-looking database calls and the
+    # await_only(send(...)) calls hand control back to the event loop
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                               for name, value in headers]
+
+    body = app(environ, start_response)
+    try:
+        await_only(send({
+            'type': 'http.response.start',
+            'status': response['status'],
+            'headers': response['headers']
+        }))
+        # streamed responses (exports) go out chunk by chunk
+        for chunk in body:
+            if chunk:
+                await_only(send({'type': 'http.response.body', 'body': chunk, 'more_body': True}))
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    await_only(send({'type': 'http.response.body', 'body': b''}))
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for engine in [primary_engine] + list(replica_engines.values()):
+                await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    # a fresh context per request keeps Flask's context locals apart while
+    # requests interleave on the event loop
+    context = contextvars.copy_context()
+    await greenlet_spawn(context.run, run_wsgi, wsgi_environ(scope, b''.join(chunks)), send)
@@ -0,0 +1,374 @@
+#----------------------------------------------------------------------------#
+# Route benchmarks.
+#
+# Drives every route of the app in-process, one route at a time from a pool
+# of concurrent clients, against the database behind DATABASE_URL (seed it
+# with bench/seed.py), and prints throughput, p50/p95/p99 latency and SQL
+# statements per request for each:
+#
+#   python bench/load.py --requests 200 --concurrency 8 --save-baseline
+#   python bench/load.py --check
+#
+# --check exits non-zero when a route runs more statements per request than in
+# the stored baseline, or its p95 grows past --tolerance of it. Latencies only
+# compare on the same machine and catalog; keep the baseline local.
+#
+# Requests over their SQL budget (config.py) fail and count as errors. The
+# page cache is off unless CACHE_ENABLED=1. Venues, artists and shows the
+# write routes create are deleted again at the end.
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault('FYYUR_ENV', 'production')
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ.setdefault('CACHE_ENABLED', '0')
+# a request over its SQL budget fails, and counts as an error
+os.environ.setdefault('SQL_QUERY_BUDGET_STRICT', '1')
+# keep the bench's metrics out of a server running on the same host
+os.environ.setdefault('METRICS_DIR', '')
+# production logs every request to stderr; keep only warnings and errors
+# next to the report
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import create_app, refresh_show_counts
+from models import db, artist_genres, Venue, Artist, Show
+
+BASELINE = os.path.join(APP_DIR, 'bench', 'baseline.json')
+
+# exports stream whole tables; a few requests are enough
+EXPORT_REQUESTS = 3
+
+# name, HTTP method, endpoint it covers, request(fixtures, number) -> (path,
+# form data), and an optional count(fixtures, requests) -> requests to send.
+# Routes run in this order: the venues 'create venue' adds are the ones
+# 'delete venue' removes.
+Route = namedtuple('Route', ['name', 'method', 'endpoint', 'request', 'count'])
+
+
+def exports(fixtures, requests):
+    return min(requests, EXPORT_REQUESTS)
+
+
+ROUTES = [
+    Route('home', 'GET', 'fyyur.index', lambda f, n: ('/', None), None),
+    Route('venues', 'GET', 'fyyur.venues', lambda f, n: ('/venues', None), None),
+    Route('venues by genre', 'GET', 'fyyur.venues',
+          lambda f, n: ('/venues?genre=' + quote(f.genre(n)), None), None),
+    Route('venue', 'GET', 'fyyur.show_venue',
+          lambda f, n: ('/venues/{}'.format(f.venue(n)['id']), None), None),
+    Route('artists', 'GET', 'fyyur.artists', lambda f, n: ('/artists', None), None),
+    Route('artists by genre', 'GET', 'fyyur.artists',
+          lambda f, n: ('/artists?genre=' + quote(f.genre(n)), None), None),
+    Route('artist', 'GET', 'fyyur.show_artist',
+          lambda f, n: ('/artists/{}'.format(f.artist(n)['id']), None), None),
+    Route('shows', 'GET', 'fyyur.shows', lambda f, n: ('/shows', None), None),
+    Route('shows, older page', 'GET', 'fyyur.shows',
+          lambda f, n: ('/shows?before=' + quote(f.last_year), None), None),
+    Route('search', 'GET', 'fyyur.search',
+          lambda f, n: ('/search?search_term=' + quote(f.term(n)), None), None),
+    Route('search venues', 'POST', 'fyyur.search_venues',
+          lambda f, n: ('/venues/search', {'search_term': f.name_term(n)}), None),
+    Route('search artists', 'POST', 'fyyur.search_artists',
+          lambda f, n: ('/artists/search', {'search_term': f.name_term(n)}), None),
+    Route('api venues', 'GET', 'fyyur.api_list',
+          lambda f, n: ('/api/v1/venues?fields=id,name,city,genres', None), None),
+    Route('api artists', 'GET', 'fyyur.api_list', lambda f, n: ('/api/v1/artists', None), None),
+    Route('api shows', 'GET', 'fyyur.api_list',
+          lambda f, n: ('/api/v1/shows?venue_id={}'.format(f.venue(n)['id']), None), None),
+    Route('api venue', 'GET', 'fyyur.api_detail',
+          lambda f, n: ('/api/v1/venues/{}?fields=id,name,genres'.format(f.venue(n)['id']), None), None),
+    Route('api artist', 'GET', 'fyyur.api_detail',
+          lambda f, n: ('/api/v1/artists/{}'.format(f.artist(n)['id']), None), None),
+    Route('export venues', 'GET', 'fyyur.export', lambda f, n: ('/export/venues?format=csv', None), exports),
+    Route('export artists', 'GET', 'fyyur.export', lambda f, n: ('/export/artists?format=jsonl', None), exports),
+    Route('export shows', 'GET', 'fyyur.export', lambda f, n: ('/export/shows?format=csv', None), exports),
+    Route('prometheus metrics', 'GET', 'fyyur.metrics', lambda f, n: ('/metrics', None), None),
+    Route('cache metrics', 'GET', 'fyyur.cache_metrics', lambda f, n: ('/metrics/cache', None), None),
+    Route('pool metrics', 'GET', 'fyyur.pool_metrics', lambda f, n: ('/metrics/pool', None), None),
+    Route('sql metrics', 'GET', 'fyyur.sql_metrics', lambda f, n: ('/metrics/sql', None), None),
+    Route('new venue form', 'GET', 'fyyur.create_venue_form', lambda f, n: ('/venues/create', None), None),
+    Route('new artist form', 'GET', 'fyyur.create_artist_form', lambda f, n: ('/artists/create', None), None),
+    Route('new show form', 'GET', 'fyyur.create_shows', lambda f, n: ('/shows/create', None), None),
+    Route('edit venue form', 'GET', 'fyyur.edit_venue',
+          lambda f, n: ('/venues/{}/edit'.format(f.venue(n)['id']), None), None),
+    Route('edit artist form', 'GET', 'fyyur.edit_artist',
+          lambda f, n: ('/artists/{}/edit'.format(f.artist(n)['id']), None), None),
+    # edits resubmit the current values, leaving the catalog as it was
+    Route('edit venue', 'POST', 'fyyur.edit_venue_submission',
+          lambda f, n: ('/venues/{}/edit'.format(f.venue(n)['id']), f.venue(n)), None),
+    Route('edit artist', 'POST', 'fyyur.edit_artist_submission',
+          lambda f, n: ('/artists/{}/edit'.format(f.artist(n)['id']), f.artist(n)), None),
+    Route('create venue', 'POST', 'fyyur.create_venue_submission',
+          lambda f, n: ('/venues/create', f.new_venue(n)), None),
+    Route('create artist', 'POST', 'fyyur.create_artist_submission',
+          lambda f, n: ('/artists/create', f.new_artist(n)), None),
+    Route('create show', 'POST', 'fyyur.create_show_submission',
+          lambda f, n: ('/shows/create', f.new_show(n)), None),
+    Route('delete venue', 'POST', 'fyyur.delete_venue',
+          lambda f, n: ('/venues/{}'.format(f.created_venues[n]), None),
+          lambda f, requests: len(f.created_venues)),
+]
+
+NEW_VENUE = 'Bench Venue {}'
+NEW_ARTIST = 'Bench Artist {}'
+
+
+class Fixtures:
+    # ids and field values the routes request, sampled from the catalog
+
+    def __init__(self, sample_size, seed):
+        rng = random.Random(seed)
+        venue_ids = [row.id for row in db.session.query(Venue.id)]
+        artist_ids = [row.id for row in db.session.query(Artist.id)]
+        if not venue_ids or not artist_ids:
+            raise SystemExit('The catalog is empty; seed it with bench/seed.py first.')
+        self.venues = [self.fields(venue) for venue in Venue.query.filter(
+            Venue.id.in_(rng.sample(venue_ids, min(sample_size, len(venue_ids)))))]
+        self.artists = [self.fields(artist) for artist in Artist.query.filter(
+            Artist.id.in_(rng.sample(artist_ids, min(sample_size, len(artist_ids)))))]
+        self.genres = sorted({genre for entity in self.venues + self.artists for genre in entity['genres']})
+        # search terms: words from the sampled names and cities
+        self.name_terms = sorted({word for entity in self.venues + self.artists
+                                  for word in entity['name'].split() if not word.isdigit()})
+        self.terms = sorted({entity['city'] for entity in self.venues} | set(self.genres))
+        self.last_year = (datetime.now() - timedelta(days=365)).replace(microsecond=0).isoformat()
+        self.created_venues = []
+
+    @staticmethod
+    def fields(entity):
+        return {
+            'name': entity.name,
+            'genres': [genre.name for genre in entity.genres],
+            'city': entity.city,
+            'state': entity.state,
+            'phone': entity.phone or '',
+            'facebook_link': entity.facebook_link or '',
+            'id': entity.id
+        }
+
+    def venue(self, number):
+        return self.venues[number % len(self.venues)]
+
+    def artist(self, number):
+        return self.artists[number % len(self.artists)]
+
+    def genre(self, number):
+        return self.genres[number % len(self.genres)]
+
+    def term(self, number):
+        return self.terms[number % len(self.terms)]
+
+    def name_term(self, number):
+        return self.name_terms[number % len(self.name_terms)]
+
+    def new_venue(self, number):
+        return {
+            'name': NEW_VENUE.format(number), 'city': 'Austin', 'state': 'TX',
+            'address': '1 Bench Street', 'phone': '512-555-0100', 'genres': [self.genre(number)],
+            'image_link': 'https://images.example.com/bench.jpg',
+            'facebook_link': 'https://www.facebook.com/bench', 'seeking_talent_description': ''
+        }
+
+    def new_artist(self, number):
+        return {
+            'name': NEW_ARTIST.format(number), 'city': 'Austin', 'state': 'TX',
+            'phone': '512-555-0100', 'website': 'https://bench.example.com',
+            'genres': [self.genre(number)], 'image_link': 'https://images.example.com/bench.jpg',
+            'facebook_link': 'https://www.facebook.com/bench', 'seeking_description': ''
+        }
+
+    def new_show(self, number):
+        start_time = datetime.now() + timedelta(days=30, hours=number)
+        return {
+            'venue_id': self.venue(number)['id'],
+            'artist_id': self.artist(number)['id'],
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+    def reload(self):
+        self.created_venues = [row.id for row in db.session.query(Venue.id).filter(
+            Venue.name.like(NEW_VENUE.format('%'))).order_by(Venue.id)]
+
+
+# SQL statements sent by the current thread, i.e. by the request it is serving
+statements = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.count = getattr(statements, 'count', 0) + 1
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_route(app, route, requests, concurrency):
+    clients = threading.local()
+
+    def send(request):
+        path, data = request
+        client = getattr(clients, 'client', None)
+        if client is None:
+            client = clients.client = app.test_client()
+        statements.count = 0
+        started = time.perf_counter()
+        # buffered: streamed responses are read to the end
+        response = client.open(path, method=route.method, data=data, buffered=True)
+        latency = time.perf_counter() - started
+        response.close()
+        return latency, statements.count, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(send, requests))
+    elapsed = time.perf_counter() - started
+    if not results:
+        return None
+    latencies = sorted(latency for latency, count, status in results)
+    counts = sorted(count for latency, count, status in results)
+    return {
+        'requests': len(results),
+        'rps': len(results) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'queries': percentile(counts, 0.50),
+        'max_queries': counts[-1],
+        'errors': sum(1 for latency, count, status in results if status >= 400)
+    }
+
+
+def catalog_size():
+    return {
+        'venues': db.session.query(db.func.count(Venue.id)).scalar(),
+        'artists': db.session.query(db.func.count(Artist.id)).scalar(),
+        'shows': db.session.query(db.func.count(Show.id)).scalar()
+    }
+
+
+def clean_up(first_new_artist, first_new_show):
+    # drop what the write routes added and recount the touched venues/artists
+    shows = db.session.query(Show.venue_id, Show.artist_id).filter(Show.id >= first_new_show).all()
+    new_artists = [row.id for row in db.session.query(Artist.id).filter(
+        Artist.id >= first_new_artist, Artist.name.like(NEW_ARTIST.format('%')))]
+    new_venues = [row.id for row in db.session.query(Venue.id).filter(Venue.name.like(NEW_VENUE.format('%')))]
+    db.session.query(Show).filter(Show.id >= first_new_show).delete(synchronize_session=False)
+    if new_artists:
+        db.session.execute(artist_genres.delete().where(artist_genres.c.artist_id.in_(new_artists)))
+        db.session.query(Artist).filter(Artist.id.in_(new_artists)).delete(synchronize_session=False)
+    for venue in Venue.query.filter(Venue.id.in_(new_venues)):
+        db.session.delete(venue)
+    refresh_show_counts(venue_ids={row.venue_id for row in shows}, artist_ids={row.artist_id for row in shows})
+    db.session.commit()
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    # regressions against the baseline, one message per route
+    failures = []
+    for name, result in results.items():
+        base = baseline['routes'].get(name)
+        if base is None or result is None:
+            continue
+        if result['queries'] > base['queries']:
+            failures.append('{}: {} statements per request, baseline {}'.format(
+                name, result['queries'], base['queries']))
+        limit = base['p95_ms'] * (1 + tolerance) + slack_ms
+        if result['p95_ms'] > limit:
+            failures.append('{}: p95 {:.1f} ms, baseline {:.1f} ms (limit {:.1f} ms)'.format(
+                name, result['p95_ms'], base['p95_ms'], limit))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every route and compare against a baseline.')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per read route')
+    parser.add_argument('--route', dest='routes', action='append', help='only run this route (repeatable)')
+    parser.add_argument('--sample', type=int, default=100, help='venues/artists the requests spread over')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--check', action='store_true', help='fail on regressions against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 growth, as a fraction')
+    parser.add_argument('--slack-ms', type=float, default=2.0, help='allowed p95 growth on top, in ms')
+    args = parser.parse_args()
+
+    app = create_app()
+    routes = [route for route in ROUTES if not args.routes or route.name in args.routes]
+    if not args.routes:
+        # every route of the app must be benchmarked
+        covered = {route.endpoint for route in ROUTES}
+        missing = sorted({rule.endpoint for rule in app.url_map.iter_rules()} - covered - {'static'})
+        if missing:
+            raise SystemExit('No benchmark for {}; add them to ROUTES.'.format(', '.join(missing)))
+
+    with app.app_context():
+        fixtures = Fixtures(args.sample, args.seed)
+        size = catalog_size()
+        first_new_artist = (db.session.query(db.func.max(Artist.id)).scalar() or 0) + 1
+        first_new_show = (db.session.query(db.func.max(Show.id)).scalar() or 0) + 1
+        db.session.remove()
+
+    print('{venues} venues, {artists} artists, {shows} shows'.format(**size))
+    print('{:<20} {:>8} {:>9} {:>9} {:>9} {:>9} {:>8} {:>7}'.format(
+        'route', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'errors'))
+    results = {}
+    try:
+        for route in routes:
+            with app.app_context():
+                fixtures.reload()
+                count = route.count(fixtures, args.requests) if route.count else args.requests
+                requests = [route.request(fixtures, number) for number in range(count)]
+                db.session.remove()
+            if route.method == 'GET' and route.count is None:
+                run_route(app, route, requests[:args.warmup], args.concurrency)
+            result = results[route.name] = run_route(app, route, requests, args.concurrency)
+            if result is None:
+                print('{:<20} {:>8}'.format(route.name, 0))
+                continue
+            print('{:<20} {requests:>8} {rps:>9.1f} {p50_ms:>9.1f} {p95_ms:>9.1f} {p99_ms:>9.1f} '
+                  '{queries:>8} {errors:>7}'.format(route.name, **result))
+    finally:
+        with app.app_context():
+            clean_up(first_new_artist, first_new_show)
+
+    errors = sum(result['errors'] for result in results.values() if result)
+    failures = ['{} requests failed'.format(errors)] if errors else []
+    if args.check:
+        if not os.path.exists(args.baseline):
+            raise SystemExit('No baseline at {}; run with --save-baseline first.'.format(args.baseline))
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['catalog'] != size:
+            print('Note: the baseline was taken on a different catalog ({venues} venues, '
+                  '{artists} artists, {shows} shows).'.format(**baseline['catalog']))
+        failures.extend(compare(results, baseline, args.tolerance, args.slack_ms))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'catalog': size, 'routes': results}, baseline_file, indent=2, sort_keys=True)
+        print('Saved the baseline to {}'.format(args.baseline))
+    for failure in failures:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
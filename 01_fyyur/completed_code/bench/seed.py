@@ -0,0 +1,164 @@
+#----------------------------------------------------------------------------#
+# Synthetic catalog.
+#
+# Fills the database behind DATABASE_URL with reproducible fake venues,
+# artists and shows for the benchmarks (the same --seed gives the same rows):
+#
+#   python bench/seed.py --venues 10000 --artists 50000 --shows 1000000
+#
+# Rows go in as batched INSERTs (executemany), with the search documents and
+# show counters the app would have kept. Run `flask db upgrade` first, or pass
+# --create-tables for a throwaway SQLite file. The database must be empty
+# unless --reset is given, which deletes the whole catalog first.
+#----------------------------------------------------------------------------#
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from app import batched, create_app, refresh_show_counts, search_document
+from forms import VenueForm
+from models import db, Genre, venue_genres, artist_genres, Venue, Artist, Show
+
+WORDS = ('The', 'Musical', 'Hop', 'Wild', 'Sax', 'Band', 'Park', 'Square', 'Live', 'Music',
+         'Coffee', 'Dueling', 'Pianos', 'Bar', 'Guns', 'Petals', 'Blue', 'Note', 'Red', 'Room',
+         'Velvet', 'Echo', 'Lounge', 'Hall', 'Garden', 'Basement', 'Sound', 'Club', 'Stage', 'House')
+CITIES = (('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Chicago', 'IL'),
+          ('Seattle', 'WA'), ('Nashville', 'TN'), ('New Orleans', 'LA'), ('Denver', 'CO'),
+          ('Portland', 'OR'), ('Boston', 'MA'), ('Atlanta', 'GA'), ('Detroit', 'MI'))
+
+
+def fake_name(rng, number):
+    return '{} {} {}'.format(' '.join(rng.sample(WORDS, rng.randint(1, 3))), rng.choice(WORDS), number)
+
+
+def fake_venue(rng, number, genres):
+    city, state = rng.choice(CITIES)
+    seeking = rng.random() < 0.3
+    return {
+        'name': fake_name(rng, number),
+        'city': city,
+        'state': state,
+        'address': '{} {} Street'.format(rng.randint(1, 9999), rng.choice(WORDS)),
+        'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+        'image_link': 'https://images.example.com/venues/{}.jpg'.format(number),
+        'website': 'https://venue{}.example.com'.format(number),
+        'facebook_link': 'https://www.facebook.com/venue{}'.format(number),
+        'seeking_talent': 'y' if seeking else None,
+        'seeking_talent_description': 'Looking for {} acts'.format(rng.choice(genres)) if seeking else None,
+        'genres': rng.sample(genres, rng.randint(1, 3))
+    }
+
+
+def fake_artist(rng, number, genres):
+    city, state = rng.choice(CITIES)
+    seeking = rng.random() < 0.3
+    return {
+        'name': fake_name(rng, number),
+        'city': city,
+        'state': state,
+        'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+        'image_link': 'https://images.example.com/artists/{}.jpg'.format(number),
+        'website': 'https://artist{}.example.com'.format(number),
+        'facebook_link': 'https://www.facebook.com/artist{}'.format(number),
+        'seeking_venue': 'y' if seeking else None,
+        'seeking_description': 'Touring {}'.format(rng.choice(CITIES)[0]) if seeking else None,
+        'genres': rng.sample(genres, rng.randint(1, 3))
+    }
+
+
+def insert_batches(table, rows, batch_size, statement=None):
+    for batch in batched(rows, batch_size):
+        db.session.execute(statement if statement is not None else table.insert(), batch)
+
+
+def insert_entities(model, links, link_column, records, genre_ids, batch_size):
+    # entity rows with their search documents, then their genre links. Ids
+    # are read back in insert order, as the table starts out empty.
+    if db.engine.dialect.name == 'postgresql':
+        search_vector = db.func.to_tsvector('english', db.bindparam('document'))
+    else:
+        search_vector = db.bindparam('document')
+    statement = model.__table__.insert().values(search_vector=search_vector)
+    genre_rows = {name: Genre(name=name) for name in genre_ids}
+
+    def rows():
+        for record in records:
+            row = dict(record)
+            genres = row.pop('genres')
+            # the same document update_search_vector builds for the ORM
+            document = search_document(model(genres=[genre_rows[name] for name in genres], **row))
+            row['document'] = document if db.engine.dialect.name == 'postgresql' else document.lower()
+            yield row
+
+    insert_batches(model.__table__, rows(), batch_size, statement)
+    ids = [row.id for row in db.session.query(model.id).order_by(model.id)]
+    link_rows = ({'genre_id': genre_ids[name], link_column: entity_id}
+                 for entity_id, record in zip(ids, records) for name in record['genres'])
+    insert_batches(links, link_rows, batch_size)
+    return ids
+
+
+def seed(args):
+    app = create_app()
+    with app.app_context():
+        if args.create_tables:
+            db.create_all()
+        if db.session.query(Venue.id).first() or db.session.query(Artist.id).first():
+            if not args.reset:
+                raise SystemExit('The database already holds venues or artists; pass --reset to replace them.')
+            for table in (Show.__table__, venue_genres, artist_genres, Venue.__table__, Artist.__table__, Genre.__table__):
+                db.session.execute(table.delete())
+            db.session.commit()
+
+        rng = random.Random(args.seed)
+        started = time.perf_counter()
+        names = [value for value, label in VenueForm.genres.kwargs['choices']]
+        db.session.execute(Genre.__table__.insert(), [{'name': name} for name in names])
+        genre_ids = {genre.name: genre.id for genre in Genre.query}
+
+        venues = [fake_venue(rng, number, names) for number in range(1, args.venues + 1)]
+        venue_ids = insert_entities(Venue, venue_genres, 'venue_id', venues, genre_ids, args.batch_size)
+        print('{} venues'.format(len(venue_ids)))
+        artists = [fake_artist(rng, number, names) for number in range(1, args.artists + 1)]
+        artist_ids = insert_entities(Artist, artist_genres, 'artist_id', artists, genre_ids, args.batch_size)
+        print('{} artists'.format(len(artist_ids)))
+
+        # shows spread over the past two years and the coming one
+        now = datetime.now().replace(second=0, microsecond=0)
+        first = now - timedelta(days=730)
+        minutes = 3 * 365 * 24 * 60
+        shows = ({
+            'venue_id': rng.choice(venue_ids),
+            'artist_id': rng.choice(artist_ids),
+            'start_time': first + timedelta(minutes=rng.randrange(0, minutes, 30))
+        } for _ in range(args.shows))
+        insert_batches(Show.__table__, shows, args.batch_size)
+        print('{} shows'.format(args.shows))
+
+        refresh_show_counts(now=now)
+        db.session.commit()
+        print('Seeded in {:.1f}s'.format(time.perf_counter() - started))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill the database with synthetic venues, artists and shows.')
+    parser.add_argument('--venues', type=int, default=10000)
+    parser.add_argument('--artists', type=int, default=50000)
+    parser.add_argument('--shows', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=1, help='random seed; the same seed gives the same catalog')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows per INSERT')
+    parser.add_argument('--reset', action='store_true', help='delete the existing catalog first')
+    parser.add_argument('--create-tables', action='store_true', help='create missing tables (throwaway databases)')
+    args = parser.parse_args()
+    seed(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#----------------------------------------------------------------------------#
+# WSGI vs ASGI throughput.
+#
+# Starts the app under each server in turn, replays the read-heavy pages from
+# a pool of concurrent clients and prints requests/sec and latency for both:
+#
+#   python bench/serving.py --requests 2000 --concurrency 50
+#
+# Point DATABASE_URL at a seeded database. Both servers run the production
+# config, with the page cache turned off so every request reaches the
+# database.
+#----------------------------------------------------------------------------#
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# both servers build the app from the production config, which asgi.py
+# defaults to anyway
+os.environ.setdefault('FYYUR_ENV', 'production')
+os.environ.setdefault('SECRET_KEY', 'bench')
+# keep the bench's metrics out of a server running on the same host
+os.environ.setdefault('METRICS_DIR', '')
+# production logs every request to stderr; keep only warnings and errors
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+PATHS = [
+    '/venues',
+    '/artists',
+    '/shows',
+    '/venues/1',
+    '/artists/1',
+    '/search?search_term=the',
+    '/api/v1/shows'
+]
+
+SERVERS = {
+    # the current path: the threaded development server behind app.run(),
+    # with the app from create_app()
+    'wsgi': [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--no-reload', '--no-debugger',
+             '--port', '{port}'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--log-level', 'warning',
+             '--port', '{port}']
+}
+
+
+def wait_until_up(server, base_url, log_file, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    # show why: the server's stderr, e.g. a missing SECRET_KEY or driver
+    log_file.seek(0)
+    sys.stderr.write(log_file.read().decode('utf-8', 'replace'))
+    raise SystemExit('server at {} did not come up'.format(base_url))
+
+
+def fetch(url):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            response.read()
+        ok = True
+    except (urllib.error.URLError, ConnectionError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_load(base_url, paths, requests, concurrency):
+    urls = [base_url + paths[number % len(paths)] for number in range(requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(fetch, urls))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, ok in results)
+    return {
+        'rps': requests / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'errors': sum(1 for latency, ok in results if not ok)
+    }
+
+
+def bench_server(name, port, args):
+    env = dict(os.environ, CACHE_ENABLED='0', FLASK_DEBUG='0')
+    command = [part.format(port=port) for part in SERVERS[name]]
+    # stderr is kept aside (the development server logs every request
+    # there) and shown if the server does not come up
+    log_file = tempfile.TemporaryFile()
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log_file)
+    try:
+        base_url = 'http://127.0.0.1:{}'.format(port)
+        wait_until_up(server, base_url, log_file)
+        # warm up connections and template caches
+        run_load(base_url, args.paths, min(args.requests, 100), args.concurrency)
+        return run_load(base_url, args.paths, args.requests, args.concurrency)
+    finally:
+        server.terminate()
+        server.wait()
+        log_file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare requests/sec of the WSGI and ASGI servers.')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--path', dest='paths', action='append', help='page to request (repeatable)')
+    parser.add_argument('--server', dest='servers', action='append', choices=sorted(SERVERS))
+    args = parser.parse_args()
+    args.paths = args.paths or PATHS
+
+    print('{:<6} {:>10} {:>10} {:>10} {:>8}'.format('server', 'req/s', 'p50 ms', 'p95 ms', 'errors'))
+    for name in args.servers or ['wsgi', 'asgi']:
+        result = bench_server(name, args.port, args)
+        print('{:<6} {:>10.1f} {:>10.1f} {:>10.1f} {:>8}'.format(
+            name, result['rps'], result['p50_ms'], result['p95_ms'], result['errors']))
+
+
+if __name__ == '__main__':
+    main()
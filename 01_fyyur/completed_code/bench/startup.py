@@ -0,0 +1,83 @@
+#----------------------------------------------------------------------------#
+# Startup budget.
+#
+# Measures, in fresh interpreters, how long `import app` takes (from
+# `python -X importtime`) and how long it takes to build the app and answer a
+# first request. Exits non-zero when the import goes over its budget or pulls
+# in a module that should only load on demand:
+#
+#   python bench/startup.py --budget-ms 500
+#----------------------------------------------------------------------------#
+
+import argparse
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# only needed by a few views or commands; importing the app must not load them
+LAZY_MODULES = ('alembic', 'flask_migrate', 'dateutil.parser', 'phonenumbers')
+
+FIRST_REQUEST = '''
+import time
+started = time.perf_counter()
+from app import create_app
+app = create_app()
+app.test_client().get({path!r})
+print(time.perf_counter() - started)
+'''
+
+
+def import_times():
+    # {module: (self_us, cumulative_us)} for one `import app`
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=APP_DIR, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def first_request_seconds(path):
+    result = subprocess.run([sys.executable, '-c', FIRST_REQUEST.format(path=path)],
+                            cwd=APP_DIR, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of the app against a budget.')
+    parser.add_argument('--budget-ms', type=float, default=500)
+    parser.add_argument('--repeat', type=int, default=5, help='runs to take the best of')
+    parser.add_argument('--path', default='/', help='page for the first request')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times['app'][1])
+    import_ms = best['app'][1] / 1000.0
+    first_request_ms = min(first_request_seconds(args.path) for _ in range(args.repeat)) * 1000
+
+    print('import app:        {:8.1f} ms (budget {:.0f} ms)'.format(import_ms, args.budget_ms))
+    print('first request {:<4} {:8.1f} ms'.format(args.path, first_request_ms))
+    print('slowest imports (cumulative):')
+    top_level = [(name, times) for name, times in best.items() if name != 'app']
+    for name, (self_us, cumulative_us) in sorted(top_level, key=lambda item: -item[1][1])[:args.top]:
+        print('  {:<40} {:8.1f} ms'.format(name, cumulative_us / 1000.0))
+
+    failures = []
+    if import_ms > args.budget_ms:
+        failures.append('import app took {:.1f} ms, over the {:.0f} ms budget'.format(import_ms, args.budget_ms))
+    for name in LAZY_MODULES:
+        if name in best:
+            failures.append('{} is imported at startup'.format(name))
+    for failure in failures:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#----------------------------------------------------------------------------#
+# Page cache.
+#
+# Backends store plain key/value pairs with a TTL. PageCache adds namespaces
+# on top: every key embeds the current version of the namespaces it depends
+# on, so invalidating a namespace is a single version bump that works the same
+# way for the in-process LRU and for a cache shared between workers.
+#----------------------------------------------------------------------------#
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from importlib import import_module
+
+
+class CacheBackend:
+    # interface for cache stores; a shared store (memcached, redis, ...) only
+    # needs these four methods
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    # in-process store bounded to max_entries, evicting the least recently used
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# PageCache's bookkeeping keys (namespace versions and invalidation times):
+# evicting one would forget an invalidation, so stores that prune keep them
+METADATA_PREFIXES = ('version:', 'invalidated:')
+
+
+class FileSystemCache(CacheBackend):
+    # local stand-in for a shared cache: one pickle per key in a directory, so
+    # every worker process on the host sees the same entries. Metadata keys
+    # live in a meta/ subdirectory that is never pruned. Pruning lists and
+    # stats every entry, so each process only does it every
+    # max_entries / 10 writes, and the directory may briefly run over.
+
+    def __init__(self, directory, max_entries=1024, ttl=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prune_every = max(max_entries // 10, 1)
+        self.writes = 0
+        self.meta_directory = os.path.join(directory, 'meta')
+        os.makedirs(self.meta_directory, exist_ok=True)
+
+    def path(self, key):
+        directory = self.meta_directory if key.startswith(METADATA_PREFIXES) else self.directory
+        return os.path.join(directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as cache_file:
+                expires_at, value = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.PickleError):
+            return None
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        path = self.path(key)
+        # write then rename so readers never see a partial entry
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as cache_file:
+            pickle.dump((expires_at, value), cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if not key.startswith(METADATA_PREFIXES):
+            self.writes += 1
+            if self.writes >= self.prune_every:
+                self.writes = 0
+                self.prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for directory in (self.directory, self.meta_directory):
+            for name in os.listdir(directory):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def prune(self):
+        # entries only: not meta/, nor the files other writers are writing
+        names = [name for name in os.listdir(self.directory) if name != 'meta' and not name.endswith('.tmp')]
+        if len(names) <= self.max_entries:
+            return
+        paths = [os.path.join(self.directory, name) for name in names]
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class PageCache:
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, namespace):
+        # version entries never expire on their own; if one is evicted a new
+        # version is drawn, which only costs a miss
+        key = 'version:' + namespace
+        version = self.backend.get(key)
+        if version is None:
+            version = uuid.uuid4().hex[:12]
+            self.backend.set(key, version, ttl=0)
+        return version
+
+    def key(self, path, namespaces):
+        versions = ','.join('{}={}'.format(namespace, self.version(namespace)) for namespace in namespaces)
+        return 'page:{}|{}'.format(path, versions)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl=self.ttl if ttl is None else ttl)
+
+    def invalidate(self, *namespaces):
+        now = time.time()
+        for namespace in namespaces:
+            self.backend.set('version:' + namespace, uuid.uuid4().hex[:12], ttl=0)
+            self.backend.set('invalidated:' + namespace, now, ttl=0)
+
+    def invalidated_within(self, namespaces, seconds):
+        # whether any of the namespaces was invalidated in the last `seconds`
+        since = time.time() - seconds
+        return any((self.backend.get('invalidated:' + namespace) or 0) > since for namespace in namespaces)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+        }
+
+
+def make_page_cache(config):
+    # CACHE_BACKEND is 'lru', 'filesystem' or the dotted path of a
+    # CacheBackend subclass taking (max_entries=, ttl=)
+    name = config.get('CACHE_BACKEND', 'lru')
+    max_entries = config.get('CACHE_MAX_ENTRIES', 1024)
+    if name == 'lru':
+        backend = LRUCache(max_entries=max_entries)
+    elif name == 'filesystem':
+        backend = FileSystemCache(config['CACHE_DIR'], max_entries=max_entries)
+    else:
+        module_name, class_name = name.rsplit('.', 1)
+        backend = getattr(import_module(module_name), class_name)(max_entries=max_entries)
+    return PageCache(backend, ttl=config.get('CACHE_DEFAULT_TTL'))
@@ -0,0 +1,106 @@
+#----------------------------------------------------------------------------#
+# Catalog files.
+#
+# Streaming readers and writers for the CSV / JSON Lines files used by
+# `flask import`, `flask export` and the /export endpoints, plus the
+# checkpoint file that lets an interrupted import resume.
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+import os
+from itertools import islice
+
+FORMATS = ('csv', 'jsonl')
+
+
+def file_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    raise ValueError('Cannot tell the format of {}; use .csv or .jsonl'.format(path))
+
+
+def read_rows(path, format=None):
+    # yield one dict per record without loading the file
+    format = format or file_format(path)
+    with open(path, newline='', encoding='utf-8') as catalog_file:
+        if format == 'csv':
+            for row in csv.DictReader(catalog_file):
+                yield row
+        else:
+            for line in catalog_file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Checkpoint:
+    # number of input rows already handled, rewritten after every committed batch
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as checkpoint_file:
+                return int(checkpoint_file.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def save(self, rows_done):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as checkpoint_file:
+            checkpoint_file.write(str(rows_done))
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def export_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat(sep=' ')
+    return value
+
+
+def export_chunks(columns, rows, format, chunk_rows=500):
+    # serialize rows lazily, a few hundred per chunk, so a whole table can
+    # stream through constant memory. 'genres' holds a ';'-separated list,
+    # the same layout `flask import` reads.
+    if format not in FORMATS:
+        raise ValueError('Unknown export format {}'.format(format))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if format == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+    for count, row in enumerate(rows, start=1):
+        values = [export_value(value) for value in row]
+        if writer:
+            writer.writerow(values)
+        else:
+            record = dict(zip(columns, values))
+            if 'genres' in record:
+                record['genres'] = record['genres'].split(';') if record['genres'] else []
+            buffer.write(json.dumps(record))
+            buffer.write('\n')
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
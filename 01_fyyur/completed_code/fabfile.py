@@ -5,9 +5,13 @@ from fabric.contrib.console import confirm
 
 
 def test():
+    # startup budget, index use of the hot Show queries, then every route
+    # against the local benchmark baseline (seed with bench/seed.py, record
+    # with bench/load.py --save-baseline)
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python bench/startup.py && flask --app app check-query-plans && python bench/load.py --check",
+            capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
@@ -27,6 +31,22 @@ def prepare():
     commit()
     push()
 
+# run the production server locally
+
+
+def serve():
+    local("GUNICORN_PIDFILE=gunicorn.pid gunicorn -c gunicorn.conf.py wsgi:app")
+
+
+def reload():
+    # graceful: workers finish their requests, new ones read gunicorn.conf.py
+    local("kill -HUP $(cat gunicorn.pid)")
+
+
+def restart():
+    # new code: start a new master next to the old one, then stop the old one
+    local("kill -USR2 $(cat gunicorn.pid) && sleep 5 && kill -TERM $(cat gunicorn.pid.oldbin)")
+
 # deploy to heroku
 
 
@@ -17,7 +17,6 @@ from wtforms.validators import (DataRequired,
                                 ValidationError,
                                 Regexp)
 from datetime import datetime
-import phonenumbers
 
 class ShowForm(Form):
     artist_id = IntegerField(
@@ -0,0 +1,64 @@
+#----------------------------------------------------------------------------#
+# Gunicorn settings for wsgi:app.
+#
+# Every value can be overridden from the environment (GUNICORN_WORKERS, ...);
+# the defaults are derived from the host's CPU count. `kill -HUP` on the
+# master reloads this file and replaces the workers gracefully; since the app
+# is preloaded, new code needs `kill -USR2` (a new master) or a restart.
+#----------------------------------------------------------------------------#
+
+import multiprocessing
+import os
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:{}'.format(os.environ.get('PORT', 8000)))
+
+# requests mostly wait on the database: a few processes per core, each with
+# a few threads. Keep DB_POOL_SIZE + DB_MAX_OVERFLOW >= threads, and
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) under the server's max_connections.
+workers = int(os.environ.get('GUNICORN_WORKERS', cpu_count * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+# import the app once in the master; workers fork with it already loaded
+preload_app = True
+
+# behind a load balancer, keep idle connections open a little longer than
+# its own keep-alive so it never reuses a connection we just closed
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# recycle workers now and then to bound any slow memory growth; the jitter
+# keeps them from restarting all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+pidfile = os.environ.get('GUNICORN_PIDFILE')
+
+
+def on_starting(server):
+    # metrics saved by the workers of an earlier run must not add up with ours
+    from metrics import clear_metrics_dir
+    from wsgi import app
+    if app.config['METRICS_DIR']:
+        clear_metrics_dir(app.config['METRICS_DIR'])
+
+
+def worker_exit(server, worker):
+    # the last few seconds of a recycled worker's metrics
+    from wsgi import app
+    app.extensions['metrics'].save()
+
+
+def post_fork(server, worker):
+    # connections opened in the master while preloading must not be shared
+    # between workers: give each worker fresh pools
+    from models import db
+    from wsgi import app
+    with app.app_context():
+        db.engine.dispose(close=False)
+    for engine in app.extensions['replica_set'].engines.values():
+        engine.dispose(close=False)
@@ -0,0 +1,120 @@
+#----------------------------------------------------------------------------#
+# Log pipeline.
+#
+# Requests only put their log records on an in-memory queue; a listener
+# thread formats them as JSON lines and writes them to the (rotating) log
+# file, so a slow disk never holds up a response. Below WARNING, records can
+# be sampled to keep per-request logs affordable under load.
+#----------------------------------------------------------------------------#
+
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import weakref
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# LogRecord attributes that are not extra fields
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line: time, level, logger, message, any fields
+    # passed with extra={...}, and the traceback if there is one
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.levelno >= logging.WARNING:
+            entry['source'] = '{}:{}'.format(record.pathname, record.lineno)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    # keeps every WARNING and above, and a `rate` fraction of the rest
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class BackgroundQueueHandler(QueueHandler):
+    # hands records to a QueueListener thread writing to `handlers`. Each
+    # process gets its own queue and thread, including gunicorn workers
+    # forked after the app was loaded.
+
+    def __init__(self, *handlers):
+        super().__init__(queue.SimpleQueue())
+        self.handlers = handlers
+        self.listener = None
+        self.start()
+        live_handlers.add(self)
+
+    def start(self):
+        # in a forked child the parent's listener thread does not exist
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        # the listener does the formatting; only make the record safe to hand
+        # over (arguments merged into the message, traceback as text)
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def close(self):
+        # flush what is queued, then close the file
+        live_handlers.discard(self)
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+        super().close()
+
+
+# handlers not closed yet; a forked child restarts their listeners
+live_handlers = weakref.WeakSet()
+
+
+def restart_live_handlers():
+    for handler in list(live_handlers):
+        handler.start()
+
+
+os.register_at_fork(after_in_child=restart_live_handlers)
+
+
+def log_handler(config):
+    # LOG_FILE '-' writes to stderr (for process managers that collect it),
+    # anything else is a file rotated at LOG_MAX_BYTES
+    if config['LOG_FILE'] == '-':
+        output = logging.StreamHandler()
+    else:
+        output = RotatingFileHandler(
+            config['LOG_FILE'], maxBytes=config['LOG_MAX_BYTES'], backupCount=config['LOG_BACKUP_COUNT'],
+            encoding='utf-8', delay=True)
+    output.setFormatter(JsonFormatter())
+    handler = BackgroundQueueHandler(output)
+    handler.addFilter(SampleFilter(config['LOG_SAMPLE_RATE']))
+    return handler
@@ -0,0 +1,351 @@
+#----------------------------------------------------------------------------#
+# Prometheus metrics.
+#
+# Counters and histograms for /metrics, written in the Prometheus text
+# format. Every thread updates its own shard of each metric, so recording a
+# request takes no lock; a scrape adds the shards up. Shards outlive their
+# threads, so the totals never go backwards. With several worker processes,
+# each one also saves its totals to a MetricsStore directory, and a scrape
+# adds up every process's totals, whichever worker answers it, along with
+# their pool and cache stats.
+#----------------------------------------------------------------------------#
+
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+# request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# template render time buckets, in seconds
+RENDER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class ShardedMetric:
+    # name, help text and label names; values live in per-thread dicts keyed
+    # by label values
+
+    kind = None
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            # first update from this thread: the only time the lock is taken
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in pairs) + '}'
+
+    def header(self):
+        return ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.kind)]
+
+
+class Counter(ShardedMetric):
+
+    kind = 'counter'
+
+    def inc(self, labels, amount=1):
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for shard in list(self.shards):
+            for labels, value in list(shard.items()):
+                self.add(totals, labels, value)
+        return totals
+
+    def add(self, totals, labels, value):
+        totals[labels] = totals.get(labels, 0) + value
+
+    def exposition(self, totals=None):
+        lines = self.header()
+        for labels, value in sorted((self.collect() if totals is None else totals).items()):
+            lines.append('{}{} {}'.format(self.name, self.label_text(labels), value))
+        return lines
+
+
+class Histogram(ShardedMetric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, buckets):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        shard = self.shard()
+        series = shard.get(labels)
+        if series is None:
+            # a count per bucket, one for +Inf, then the sum
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        totals = {}
+        for shard in list(self.shards):
+            for labels, series in list(shard.items()):
+                self.add(totals, labels, series)
+        return totals
+
+    def add(self, totals, labels, series):
+        total = totals.get(labels)
+        if total is None:
+            totals[labels] = list(series)
+        else:
+            for index, value in enumerate(series):
+                total[index] += value
+
+    def exposition(self, totals=None):
+        lines = self.header()
+        for labels, series in sorted((self.collect() if totals is None else totals).items()):
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], series):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name, self.label_text(labels, [('le', bound)]), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, self.label_text(labels), series[-1]))
+            lines.append('{}_count{} {}'.format(self.name, self.label_text(labels), cumulative))
+        return lines
+
+
+def sample_lines(name, kind, help, samples):
+    # a metric read at scrape time; samples: [(labels dict, value)]
+    lines = ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, kind)]
+    for labels, value in samples:
+        label_text = ','.join('{}="{}"'.format(key, value) for key, value in sorted(labels.items()))
+        lines.append('{}{} {}'.format(name, '{' + label_text + '}' if label_text else '', value))
+    return lines
+
+
+# pool_stats snapshot key, metric name, type, help
+POOL_METRICS = (
+    ('size', 'fyyur_db_pool_size', 'gauge', 'Connections the pool keeps open.'),
+    ('checked_out', 'fyyur_db_pool_checked_out', 'gauge', 'Connections in use.'),
+    ('checked_in', 'fyyur_db_pool_checked_in', 'gauge', 'Idle connections in the pool.'),
+    ('overflow', 'fyyur_db_pool_overflow', 'gauge', 'Connections open beyond the pool size.'),
+    ('checkouts', 'fyyur_db_pool_checkouts_total', 'counter', 'Connections handed out.'),
+    ('timeouts', 'fyyur_db_pool_timeouts_total', 'counter', 'Checkouts that timed out waiting.'),
+    ('wait_seconds_total', 'fyyur_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.')
+)
+
+
+def pool_lines(pools):
+    # pools: {engine name: pool_stats snapshot}
+    lines = []
+    for key, name, kind, help in POOL_METRICS:
+        samples = [({'engine': engine}, stats[key]) for engine, stats in sorted(pools.items()) if key in stats]
+        if samples:
+            lines.extend(sample_lines(name, kind, help, samples))
+    return lines
+
+
+def cache_lines(cache, stats):
+    # cache: 'page' or 'fragment'
+    name = 'fyyur_{}_cache_'.format(cache)
+    title = cache.capitalize()
+    return (sample_lines(name + 'hits_total', 'counter', title + ' cache hits.', [({}, stats['hits'])]) +
+            sample_lines(name + 'misses_total', 'counter', title + ' cache misses.', [({}, stats['misses'])]) +
+            sample_lines(name + 'hit_ratio', 'gauge', title + ' cache hits per lookup since start.',
+                         [({}, stats['hit_ratio'])]))
+
+
+class MetricsStore:
+    # one JSON snapshot per process in a directory shared by the workers of a
+    # host. Snapshots of processes that exited (recycled workers) are folded
+    # into archive.json, so their counts stay in the totals.
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+
+    def write(self, snapshot, name=None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name or '{}.json'.format(os.getpid()))
+        # write then rename so readers never see a partial snapshot
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'w', encoding='utf-8') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(tmp_path, path)
+
+    def load(self, name):
+        try:
+            with open(os.path.join(self.directory, name), encoding='utf-8') as snapshot_file:
+                return json.load(snapshot_file)
+        except (OSError, ValueError):
+            return None
+
+    def read(self, combine):
+        # every snapshot in the directory; combine() adds snapshots up
+        import fcntl  # Unix only, like gunicorn
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            # one process archives at a time, so nothing is counted twice
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            exited = [name for name in os.listdir(self.directory)
+                      if name.endswith('.json') and name[:-len('.json')].isdigit()
+                      and not process_exists(int(name[:-len('.json')]))]
+            if exited:
+                snapshots = [self.load(name) for name in ['archive.json'] + exited]
+                self.write(combine([snapshot for snapshot in snapshots if snapshot]), 'archive.json')
+                for name in exited:
+                    os.remove(os.path.join(self.directory, name))
+            snapshots = [self.load(name) for name in os.listdir(self.directory) if name.endswith('.json')]
+        return [snapshot for snapshot in snapshots if snapshot]
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def clear_metrics_dir(directory):
+    # at server start: totals from an earlier run must not carry over
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+# pool_stats keys that are gauges: a process that exited no longer holds its
+# connections, so they are not archived
+POOL_GAUGES = tuple(key for key, name, kind, help in POOL_METRICS if kind == 'gauge')
+
+
+class RequestMetrics:
+    # everything /metrics reports: what is recorded per request or render,
+    # and what process_stats() returns as of now ({'pools': {engine name:
+    # pool_stats snapshot}, 'caches': {'page' or 'fragment': cache stats}})
+
+    def __init__(self, store=None, process_stats=None):
+        self.store = store
+        self.process_stats = process_stats
+        self.saver = None
+        self.lock = threading.Lock()
+        self.requests = Counter(
+            'fyyur_http_requests_total', 'Requests handled, by route, method and status.',
+            ('route', 'method', 'status'))
+        self.latency = Histogram(
+            'fyyur_http_request_duration_seconds', 'Time to handle a request, by route and method.',
+            ('route', 'method'), LATENCY_BUCKETS)
+        self.statements = Counter(
+            'fyyur_db_statements_total', 'SQL statements run, by route.', ('route',))
+        self.db_seconds = Counter(
+            'fyyur_db_seconds_total', 'Time spent in SQL statements, by route.', ('route',))
+        self.renders = Histogram(
+            'fyyur_template_render_seconds', 'Time to render a template, by template.',
+            ('template',), RENDER_BUCKETS)
+
+    def observe_request(self, route, method, status, seconds, statements, db_seconds):
+        self.requests.inc((route, method, status))
+        self.latency.observe((route, method), seconds)
+        if statements:
+            self.statements.inc((route,), statements)
+            self.db_seconds.inc((route,), db_seconds)
+
+    def observe_render(self, template, seconds):
+        self.renders.observe((template,), seconds)
+
+    @property
+    def metrics(self):
+        return (self.requests, self.latency, self.statements, self.db_seconds, self.renders)
+
+    def snapshot(self):
+        # {metric name: [[label values, value], ...], 'pools': ..., 'caches':
+        # ...}, as stored in JSON
+        snapshot = {metric.name: [[list(labels), value] for labels, value in metric.collect().items()]
+                    for metric in self.metrics}
+        snapshot.update(self.process_stats() if self.process_stats else {'pools': {}, 'caches': {}})
+        return snapshot
+
+    def combine(self, snapshots, gauges=True):
+        totals = {metric.name: {} for metric in self.metrics}
+        pools = {}
+        caches = {}
+        for snapshot in snapshots:
+            for metric in self.metrics:
+                for labels, value in snapshot.get(metric.name, ()):
+                    metric.add(totals[metric.name], tuple(labels), value)
+            for engine, stats in snapshot.get('pools', {}).items():
+                total = pools.setdefault(engine, {})
+                for key, name, kind, help in POOL_METRICS:
+                    if key in stats and (gauges or key not in POOL_GAUGES):
+                        total[key] = total.get(key, 0) + stats[key]
+            for cache, stats in snapshot.get('caches', {}).items():
+                total = caches.setdefault(cache, {'hits': 0, 'misses': 0})
+                total['hits'] += stats['hits']
+                total['misses'] += stats['misses']
+        combined = {name: [[list(labels), value] for labels, value in values.items()]
+                    for name, values in totals.items()}
+        combined.update(pools=pools, caches=caches)
+        return combined
+
+    def archive(self, snapshots):
+        # the totals of exited processes, without their gauges
+        return self.combine(snapshots, gauges=False)
+
+    def save(self):
+        # this process's totals into the store
+        if self.store is not None:
+            self.store.write(self.snapshot())
+
+    def keep_saving(self):
+        # called per request: makes sure a thread saves the totals every
+        # store.interval; started on first use, and again in a forked worker,
+        # which does not inherit the thread
+        if self.store is None or (self.saver is not None and self.saver.is_alive()):
+            return
+        with self.lock:
+            if self.saver is None or not self.saver.is_alive():
+                self.saver = threading.Thread(target=self.run_saver, name='fyyur-metrics', daemon=True)
+                self.saver.start()
+
+    def run_saver(self):
+        while True:
+            time.sleep(self.store.interval)
+            try:
+                self.save()
+            except OSError:
+                # a full or read-only disk; try again next time
+                pass
+
+    def exposition(self):
+        if self.store is None:
+            combined = self.combine([self.snapshot()])
+        else:
+            self.save()
+            combined = self.combine(self.store.read(self.archive))
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.exposition({tuple(labels): value for labels, value in combined[metric.name]}))
+        lines.extend(pool_lines(combined['pools']))
+        for cache, stats in sorted(combined['caches'].items()):
+            lookups = stats['hits'] + stats['misses']
+            lines.extend(cache_lines(cache, dict(stats, hit_ratio=float(stats['hits']) / lookups if lookups else 0.0)))
+        return lines
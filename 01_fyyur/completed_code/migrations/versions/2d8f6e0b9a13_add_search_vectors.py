@@ -0,0 +1,48 @@
+"""add full-text search vectors to Venue and Artist
+
+Revision ID: 2d8f6e0b9a13
+Revises: 9e4b7a1c5d20
+Create Date: 2020-09-23 09:27:51.630244
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '2d8f6e0b9a13'
+down_revision = '9e4b7a1c5d20'
+branch_labels = None
+depends_on = None
+
+DOCUMENTS = {
+    'Venue': ['name', 'city', 'state', 'address', 'seeking_talent_description', 'genres'],
+    'Artist': ['name', 'city', 'state', 'seeking_description', 'genres'],
+}
+
+# genres are stored as '{Jazz,"Rock n Roll"}'; strip the punctuation
+GENRE_WORDS = "replace(replace(replace(replace(genres, '{', ' '), '}', ' '), '\"', ' '), ',', ' ')"
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    column_type = postgresql.TSVECTOR() if postgres else sa.Text()
+    for table, fields in DOCUMENTS.items():
+        op.add_column(table, sa.Column('search_vector', column_type, nullable=True))
+        # backfill; new and edited rows are kept up to date by the ORM hooks in app.py
+        document = " || ' ' || ".join(
+            "coalesce({}, '')".format(GENRE_WORDS if field == 'genres' else field) for field in fields)
+        if postgres:
+            op.execute('UPDATE "{}" SET search_vector = to_tsvector(\'english\', {})'.format(table, document))
+            op.create_index('ix_{}_search_vector'.format(table.lower()), table, ['search_vector'],
+                            unique=False, postgresql_using='gin')
+        else:
+            op.execute('UPDATE "{}" SET search_vector = lower({})'.format(table, document))
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    for table in DOCUMENTS:
+        if postgres:
+            op.drop_index('ix_{}_search_vector'.format(table.lower()), table_name=table)
+        op.drop_column(table, 'search_vector')
@@ -0,0 +1,38 @@
+"""add upcoming/past show counters to Venue and Artist
+
+Revision ID: 6c2f0d9e31b4
+Revises: 4a3863b80e48
+Create Date: 2020-09-21 10:12:33.402917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c2f0d9e31b4'
+down_revision = '4a3863b80e48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill from the existing shows
+    for table, fk in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.execute(
+            'UPDATE "{table}" SET '
+            'upcoming_shows_count = (SELECT count(*) FROM "Show" '
+            'WHERE "Show".{fk} = "{table}".id AND "Show".start_time > CURRENT_TIMESTAMP), '
+            'past_shows_count = (SELECT count(*) FROM "Show" '
+            'WHERE "Show".{fk} = "{table}".id AND "Show".start_time <= CURRENT_TIMESTAMP)'.format(table=table, fk=fk)
+        )
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,34 @@
+"""add trigram indexes for venue and artist name search
+
+Revision ID: 9e4b7a1c5d20
+Revises: 6c2f0d9e31b4
+Create Date: 2020-09-22 15:41:07.118530
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b7a1c5d20'
+down_revision = '6c2f0d9e31b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm GIN indexes only exist on PostgreSQL; other databases fall back
+    # to the in-process n-gram index in search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_venue_name_trgm', 'Venue', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_artist_name_trgm', 'Artist', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_artist_name_trgm', table_name='Artist')
+    op.drop_index('ix_venue_name_trgm', table_name='Venue')
@@ -0,0 +1,87 @@
+"""normalize genres into Genre with VenueGenre/ArtistGenre links
+
+Revision ID: b71e3c5a8f42
+Revises: 2d8f6e0b9a13
+Create Date: 2020-09-24 16:03:12.559871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71e3c5a8f42'
+down_revision = '2d8f6e0b9a13'
+branch_labels = None
+depends_on = None
+
+LINKS = (
+    ('Venue', 'VenueGenre', 'venue_id'),
+    ('Artist', 'ArtistGenre', 'artist_id'),
+)
+
+
+def parse_genres(value):
+    # genres were stored as the stringified list '{Jazz,"Rock n Roll"}'
+    if not value:
+        return []
+    names = (name.strip().strip('"') for name in value.strip('{}').split(','))
+    return [name for name in names if name]
+
+
+def upgrade():
+    genre = op.create_table('Genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    links = {}
+    for table, link_table, fk in LINKS:
+        links[table] = op.create_table(link_table,
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.Column(fk, sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ),
+        sa.ForeignKeyConstraint([fk], [table + '.id'], ),
+        sa.PrimaryKeyConstraint('genre_id', fk)
+        )
+        op.create_index('ix_{}_{}'.format(link_table.lower(), fk), link_table, [fk], unique=False)
+
+    # backfill the links from the old string column
+    bind = op.get_bind()
+    genre_ids = {}
+    link_rows = {}
+    for table, link_table, fk in LINKS:
+        link_rows[table] = []
+        for entity_id, value in bind.execute(sa.text('SELECT id, genres FROM "{}"'.format(table))):
+            for name in set(parse_genres(value)):
+                genre_id = genre_ids.setdefault(name, len(genre_ids) + 1)
+                link_rows[table].append({'genre_id': genre_id, fk: entity_id})
+    if genre_ids:
+        op.bulk_insert(genre, [{'id': genre_id, 'name': name} for name, genre_id in genre_ids.items()])
+    for table, rows in link_rows.items():
+        if rows:
+            op.bulk_insert(links[table], rows)
+    if genre_ids and bind.dialect.name == 'postgresql':
+        op.execute('SELECT setval(pg_get_serial_sequence(\'"Genre"\', \'id\'), (SELECT max(id) FROM "Genre"))')
+
+    for table, link_table, fk in LINKS:
+        op.drop_column(table, 'genres')
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table, link_table, fk in LINKS:
+        op.add_column(table, sa.Column('genres', sa.String(), nullable=True))
+        rows = bind.execute(sa.text(
+            'SELECT l.{fk}, g.name FROM "{link}" l JOIN "Genre" g ON g.id = l.genre_id '
+            'ORDER BY l.{fk}, g.name'.format(fk=fk, link=link_table))).fetchall()
+        genres = {}
+        for entity_id, name in rows:
+            genres.setdefault(entity_id, []).append('"{}"'.format(name) if ' ' in name else name)
+        for entity_id, names in genres.items():
+            bind.execute(sa.text('UPDATE "{}" SET genres = :genres WHERE id = :id'.format(table)),
+                         {'genres': '{' + ','.join(names) + '}', 'id': entity_id})
+        op.drop_index('ix_{}_{}'.format(link_table.lower(), fk), table_name=link_table)
+        op.drop_table(link_table)
+    op.drop_table('Genre')
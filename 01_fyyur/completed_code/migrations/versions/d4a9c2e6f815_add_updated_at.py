@@ -0,0 +1,35 @@
+"""add updated_at timestamps to Venue, Artist and Show
+
+Revision ID: d4a9c2e6f815
+Revises: b71e3c5a8f42
+Create Date: 2020-09-25 11:48:26.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a9c2e6f815'
+down_revision = 'b71e3c5a8f42'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Venue', 'Artist', 'Show')
+
+
+def upgrade():
+    for table in TABLES:
+        # add nullable, stamp existing rows, then tighten (batch mode keeps
+        # this working on SQLite, which cannot ALTER COLUMN)
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute('UPDATE "{}" SET updated_at = CURRENT_TIMESTAMP'.format(table))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False,
+                                  server_default=sa.func.now())
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
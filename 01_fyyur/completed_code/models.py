@@ -0,0 +1,126 @@
+#----------------------------------------------------------------------------#
+# Models.
+#
+# Kept apart from the app so the CLI, migrations and scripts can load them
+# without building an application.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# full-text document column: a tsvector on PostgreSQL, the lowercased document
+# text elsewhere
+SearchVector = db.Text().with_variant(TSVECTOR(), 'postgresql')
+
+
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+
+# genre links; the (genre_id, ...) primary keys serve the ?genre= filters and
+# the second index serves loading an entity's genres
+venue_genres = db.Table(
+    'VenueGenre',
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id'), primary_key=True),
+    db.Index('ix_venuegenre_venue_id', 'venue_id')
+)
+
+artist_genres = db.Table(
+    'ArtistGenre',
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id'), primary_key=True),
+    db.Index('ix_artistgenre_artist_id', 'artist_id')
+)
+
+
+class Venue(db.Model):
+    __tablename__ = 'Venue'
+    __table_args__ = (
+        # trigram index backing the case-insensitive name search (PostgreSQL)
+        db.Index('ix_venue_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venue_search_vector', 'search_vector', postgresql_using='gin'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    address = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    image_link = db.Column(db.String(500))
+    genres = db.relationship('Genre', secondary=venue_genres, order_by='Genre.name', lazy='selectin')
+    website = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(500))
+    seeking_talent = db.Column(db.String)
+    seeking_talent_description = db.Column(db.String())
+    # denormalized show counters, kept in step by create_show_submission and
+    # rolled over by `flask roll-show-counts` as shows move into the past
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # name, genres, city and description for /search, set by update_search_vector
+    search_vector = db.Column(SearchVector)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.func.now())
+    venue_shows = db.relationship('Show', backref='Venues', lazy=True)
+
+    # TODO: implement any missing fields, as a database migration using Flask-Migrate
+    # COMPLETED
+
+
+class Artist(db.Model):
+    __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_artist_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_artist_search_vector', 'search_vector', postgresql_using='gin'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    website = db.Column(db.String(500))
+    image_link = db.Column(db.String(500))
+    genres = db.relationship('Genre', secondary=artist_genres, order_by='Genre.name', lazy='selectin')
+    facebook_link = db.Column(db.String(120))
+    seeking_venue = db.Column(db.String())
+    seeking_description = db.Column(db.String(1000))
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    search_vector = db.Column(SearchVector)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.func.now())
+    artist_shows = db.relationship('Show', backref='Artist', lazy=True)
+
+    # TODO: implement any missing fields, as a database migration using Flask-Migrate - COMPLETED
+
+# TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration. - COMPLETED
+
+
+class Show(db.Model):
+    __tablename__ = 'Show'
+    __table_args__ = (
+        # per-venue/per-artist time windows and the newest-first /shows listing
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_show_start_time', 'start_time'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.func.now())
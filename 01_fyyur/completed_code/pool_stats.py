@@ -0,0 +1,101 @@
+#----------------------------------------------------------------------------#
+# Connection pool stats.
+#
+# A QueuePool subclass that times every checkout (the wait for a free
+# connection, or for a new one to be opened) and counts the pool events, so
+# /metrics/pool can tell a saturated pool from a slow database.
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+# pool events counted by PoolStats
+COUNTED_EVENTS = (
+    ('checkout', 'checkouts'),
+    ('checkin', 'checkins'),
+    ('connect', 'connects'),
+    ('invalidate', 'invalidations')
+)
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self.lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool):
+        with self.lock:
+            stats = {
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_total, 6),
+                'wait_seconds_max': round(self.wait_max, 6),
+                'wait_seconds_avg': round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0
+            }
+        # gauges read straight from the pool
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0),
+                'max_overflow': pool._max_overflow
+            })
+        return stats
+
+
+def engine_pool_stats(engine):
+    pool = engine.pool
+    stats = getattr(pool, 'stats', None)
+    return stats.snapshot(pool) if stats is not None else {}
+
+
+def timed_pool_class(stats, base=QueuePool):
+    # a QueuePool (or AsyncAdaptedQueuePool) subclass bound to one PoolStats;
+    # recreate() (after dispose or an invalidation) keeps the class and hands
+    # the listeners over, so the stats survive
+    class TimedQueuePool(base):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if '_dispatch' not in kwargs:
+                for event_name, counter in COUNTED_EVENTS:
+                    event.listen(self, event_name, lambda *args, counter=counter: stats.count(counter))
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeout:
+                stats.record_wait(time.perf_counter() - started, timed_out=True)
+                raise
+            stats.record_wait(time.perf_counter() - started)
+            return connection
+
+    TimedQueuePool.stats = stats
+    return TimedQueuePool
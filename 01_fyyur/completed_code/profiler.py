@@ -0,0 +1,183 @@
+#----------------------------------------------------------------------------#
+# Sampling profiler.
+#
+# A request being profiled registers its thread; one background thread reads
+# the stacks of the registered threads every few milliseconds and counts
+# them. Profiles are written in the folded format flamegraph.pl and
+# speedscope read, one `frame;frame;frame count` line per distinct stack,
+# next to a JSON summary of the request. A rate limit caps how many are
+# written, so profiling can stay on in production.
+#----------------------------------------------------------------------------#
+
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+
+# modules whose frames mean the thread is waiting on the database
+SQL_MODULES = ('sqlalchemy.engine', 'sqlalchemy.pool', 'psycopg', 'psycopg2', 'asyncpg')
+
+
+def frame_label(frame):
+    # template frames are named after the template, everything else after its
+    # module, then the function (or template block)
+    namespace = frame.f_globals
+    if '__jinja_template__' in namespace:
+        return '{}:{}'.format(namespace.get('name'), frame.f_code.co_name)
+    return '{}:{}'.format(namespace.get('__name__') or frame.f_code.co_filename, frame.f_code.co_name)
+
+
+def fold(frame):
+    # the stack from the thread's first frame down to `frame`, and which part
+    # of the request it is in: 'sql', 'template' (rendering, outside SQL) or
+    # 'other'
+    labels = []
+    part = 'other'
+    while frame is not None:
+        labels.append(frame_label(frame))
+        if part != 'sql':
+            if frame.f_globals.get('__name__', '').startswith(SQL_MODULES):
+                part = 'sql'
+            elif '__jinja_template__' in frame.f_globals:
+                part = 'template'
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels), part
+
+
+class Profile:
+    # the samples of one request
+
+    def __init__(self, ident, forced):
+        self.ident = ident
+        self.forced = forced
+        self.started = datetime.now()
+        self.stacks = Counter()
+        self.parts = Counter()
+
+    def add(self, frame):
+        stack, part = fold(frame)
+        self.stacks[stack] += 1
+        self.parts[part] += 1
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+
+class RateLimit:
+    # at most `per_minute` events in any 60 seconds
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.events = deque()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        now = time.monotonic()
+        with self.lock:
+            while self.events and self.events[0] <= now - 60:
+                self.events.popleft()
+            if len(self.events) >= self.per_minute:
+                return False
+            self.events.append(now)
+            return True
+
+
+class SamplingProfiler:
+    # a thread's stack is attributed to the request it serves, so requests
+    # must each have their own thread; `enabled` is False where they do not
+
+    def __init__(self, interval, per_minute):
+        self.enabled = True
+        self.interval = interval
+        self.limit = RateLimit(per_minute)
+        self.profiles = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self, forced=False):
+        # profile the calling thread until stop()
+        profile = Profile(threading.get_ident(), forced)
+        with self.lock:
+            self.profiles[profile.ident] = profile
+            # started on first use, and again in a forked worker, which does
+            # not inherit the thread
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='fyyur-profiler', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return profile
+
+    def stop(self, profile):
+        with self.lock:
+            if self.profiles.get(profile.ident) is profile:
+                del self.profiles[profile.ident]
+        return profile
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.profiles:
+                    # sleep until the next profiled request
+                    self.wakeup.clear()
+                    continue
+                frames = sys._current_frames()
+                for ident, profile in self.profiles.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        profile.add(frame)
+            del frames
+
+
+def profile_token(secret, path, expires):
+    # lets whoever holds SECRET_KEY profile `path` until `expires` (a unix
+    # time): '<expires>.<signature>'
+    message = '{}:{}'.format(int(expires), path).encode('utf-8')
+    key = secret if isinstance(secret, bytes) else secret.encode('utf-8')
+    return '{}.{}'.format(int(expires), hmac.new(key, message, hashlib.sha256).hexdigest())
+
+
+def valid_profile_token(secret, path, token):
+    expires, _, signature = token.partition('.')
+    if not secret or not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(profile_token(secret, path, expires), token)
+
+
+def write_profile(directory, profile, summary, keep):
+    # <time>-<route>-<ms>ms.folded and .json; only the newest `keep` profiles
+    # are kept
+    os.makedirs(directory, exist_ok=True)
+    name = '{:%Y%m%d-%H%M%S}-{}-{}ms-{}'.format(
+        profile.started, summary['route'], int(summary['duration_ms']), uuid.uuid4().hex[:6])
+    path = os.path.join(directory, name)
+    with open(path + '.folded', 'w', encoding='utf-8') as folded_file:
+        for stack, count in profile.stacks.most_common():
+            folded_file.write('{} {}\n'.format(stack, count))
+    with open(path + '.json', 'w', encoding='utf-8') as summary_file:
+        json.dump(summary, summary_file, indent=2, default=str)
+    prune_profiles(directory, keep)
+    return path + '.folded'
+
+
+def prune_profiles(directory, keep):
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.folded')]
+    if len(paths) <= keep:
+        return
+    paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+    for path in paths[:len(paths) - keep]:
+        for stale in (path, path[:-len('.folded')] + '.json'):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
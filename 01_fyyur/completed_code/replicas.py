@@ -0,0 +1,103 @@
+#----------------------------------------------------------------------------#
+# Read replicas.
+#
+# ReplicaSet owns one engine per replica and hands them out round robin,
+# skipping the ones that failed their last health check. RoutingSession sends
+# a request's reads to the replica picked for it and everything that writes
+# (flushes, UPDATE / INSERT / DELETE statements) to the primary. The replicas
+# are not Flask-SQLAlchemy binds, so create_all and the migrations never
+# touch them.
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.dml import UpdateBase
+
+
+class ReplicaSet:
+
+    def __init__(self, engines, check_interval=30):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.use(engines)
+
+    def use(self, engines):
+        # engines maps a replica name to its engine
+        with self.lock:
+            self.engines = dict(engines)
+            self.names = list(engines)
+            self.healthy = set(self.names)
+            self.checked_at = None
+            self.position = 0
+        for name, engine in engines.items():
+            self.watch(name, engine)
+
+    def __bool__(self):
+        return bool(self.names)
+
+    def watch(self, name, engine):
+        # a dropped connection takes the replica out of rotation until the
+        # next health check instead of failing request after request
+        def handle_error(context):
+            if context.is_disconnect:
+                self.mark_down(name)
+        event.listen(engine, 'handle_error', handle_error)
+
+    def mark_down(self, name):
+        with self.lock:
+            self.healthy.discard(name)
+
+    def check(self):
+        healthy = set()
+        for name, engine in self.engines.items():
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text('SELECT 1'))
+            except SQLAlchemyError:
+                continue
+            healthy.add(name)
+        with self.lock:
+            self.healthy = healthy
+            self.checked_at = time.monotonic()
+
+    def choose(self):
+        # the engine of the next healthy replica, or None to use the primary.
+        # Health checks piggyback on the request that finds them due.
+        if not self.names:
+            return None
+        with self.lock:
+            due = self.checked_at is None or time.monotonic() - self.checked_at >= self.check_interval
+            if due:
+                # keep other threads from checking at the same time
+                self.checked_at = time.monotonic()
+        if due:
+            self.check()
+        with self.lock:
+            for _ in range(len(self.names)):
+                name = self.names[self.position % len(self.names)]
+                self.position += 1
+                if name in self.healthy:
+                    return self.engines[name]
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {name: name in self.healthy for name in self.names}
+
+
+class RoutingSession(FlaskSession):
+    # set session.info['replica'] to a replica engine to read from it, and
+    # session.info['primary'] to write somewhere other than db.engine
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            replica = self.info.get('replica')
+            if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+                return replica
+            if self.info.get('primary') is not None:
+                return self.info['primary']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,72 @@
+#----------------------------------------------------------------------------#
+# In-process n-gram search index.
+#
+# Fallback for databases without pg_trgm (SQLite, test runs): names are split
+# into lowercase n-grams held in an inverted index, so a substring search only
+# looks at names sharing every n-gram of the term instead of scanning them all.
+#----------------------------------------------------------------------------#
+
+import heapq
+
+
+def ngrams(text, n=3):
+    text = text.lower()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex:
+
+    def __init__(self, n=3):
+        self.n = n
+        self.texts = {}
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, key, text):
+        self.remove(key)
+        text = text or ''
+        self.texts[key] = text
+        for gram in ngrams(text, self.n):
+            self.postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        text = self.texts.pop(key, None)
+        if text is None:
+            return
+        for gram in ngrams(text, self.n):
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+
+    def candidates(self, term):
+        grams = ngrams(term, self.n)
+        if not grams:
+            # too short to have an n-gram: every entry is a candidate
+            return self.texts.keys()
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        keys = set(postings[0])
+        for other in postings[1:]:
+            keys &= other
+            if not keys:
+                break
+        return keys
+
+    def search(self, term, limit=None):
+        # case-insensitive substring match, best matches first: matches at the
+        # start of the name, then earlier matches, then shorter names.
+        term = term.lower()
+        ranked = []
+        for key in self.candidates(term):
+            text = self.texts[key]
+            position = text.lower().find(term)
+            if position >= 0:
+                ranked.append((position, len(text), text, key))
+        if limit is None:
+            ranked.sort()
+        else:
+            ranked = heapq.nsmallest(limit, ranked)
+        return [(key, text) for position, length, text, key in ranked]
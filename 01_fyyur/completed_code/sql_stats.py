@@ -0,0 +1,88 @@
+#----------------------------------------------------------------------------#
+# SQL stats.
+#
+# Statement counts, database time and statement fingerprints per request,
+# fed from the engines' cursor events. A fingerprint is the statement with
+# its parameters and literals blanked out, so a query issued once per row of
+# a loop (an N+1) shows up as one fingerprint with a high count.
+#----------------------------------------------------------------------------#
+
+import re
+import threading
+from collections import Counter
+
+PARAMETERS = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\$\d+|\?")
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LISTS = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    statement = PARAMETERS.sub('?', statement)
+    statement = LITERALS.sub('?', statement)
+    statement = IN_LISTS.sub('IN (...)', statement)
+    return SPACES.sub(' ', statement).strip()
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class QueryLog:
+    # the statements of one request
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.fingerprints = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold):
+        # fingerprints run at least threshold times, most frequent first
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+
+class SqlStats:
+    # totals per route across requests, for /metrics/sql
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, log, repeated, over_budget):
+        with self.lock:
+            totals = self.routes.get(route)
+            if totals is None:
+                totals = self.routes[route] = {
+                    'requests': 0,
+                    'queries': 0,
+                    'queries_max': 0,
+                    'db_seconds': 0.0,
+                    'over_budget': 0,
+                    'repeated': Counter()
+                }
+            totals['requests'] += 1
+            totals['queries'] += log.count
+            totals['queries_max'] = max(totals['queries_max'], log.count)
+            totals['db_seconds'] += log.seconds
+            totals['over_budget'] += 1 if over_budget else 0
+            totals['repeated'].update(sql for sql, count in repeated)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                route: {
+                    'requests': totals['requests'],
+                    'queries_avg': round(totals['queries'] / totals['requests'], 2),
+                    'queries_max': totals['queries_max'],
+                    'db_ms_avg': round(totals['db_seconds'] * 1000 / totals['requests'], 3),
+                    'over_budget': totals['over_budget'],
+                    # statement -> requests in which it repeated
+                    'repeated': dict(totals['repeated'].most_common(10))
+                }
+                for route, totals in self.routes.items()
+            }
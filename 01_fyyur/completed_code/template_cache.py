@@ -0,0 +1,50 @@
+#----------------------------------------------------------------------------#
+# Template caching.
+#
+# {% cache 'venue', venue.id, venue.updated_at %}...{% endcache %} renders its
+# body once per distinct key and reuses the markup after that. Keys carry the
+# version (updated_at) of everything the fragment shows, so an edit changes
+# the key instead of invalidating anything, and stale fragments age out of
+# the LRU. The first key part names the fragment, so keys of different
+# fragments never collide. Without a fragment cache on the environment, the
+# body is rendered every time.
+#----------------------------------------------------------------------------#
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+class FragmentCacheExtension(Extension):
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('render_fragment', [nodes.List(parts)]),
+                               [], [], body).set_lineno(lineno)
+
+    def render_fragment(self, parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = 'fragment:' + '|'.join(map(str, parts))
+        markup = cache.get(key)
+        if markup is None:
+            markup = caller()
+            cache.set(key, markup)
+        return markup
+
+
+def preload_templates(environment):
+    # load every template now (from the bytecode cache when it has them), so
+    # processes forked afterwards start with all of them compiled
+    for name in environment.list_templates(extensions=['html']):
+        environment.get_template(name)
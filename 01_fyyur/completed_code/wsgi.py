@@ -0,0 +1,13 @@
+#----------------------------------------------------------------------------#
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+#----------------------------------------------------------------------------#
+
+import os
+
+from app import create_app
+from template_cache import preload_templates
+
+app = create_app(os.environ.get('FYYUR_ENV', 'production'))
+# compiled in the gunicorn master, so every forked worker (including those
+# replacing recycled ones) starts with the templates in memory
+preload_templates(app.jinja_env)